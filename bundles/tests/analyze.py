@@ -0,0 +1,404 @@
+#! /usr/bin/env python3
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2024 the Tectonic Project.
+# Licensed under the MIT License.
+
+"""
+Analyze what takes up the space in a TTBv1 bundle.
+
+Everything except `--deep` works from the bundle index alone, which records
+the compressed and uncompressed size and hash of every file. We report:
+
+- compressed and uncompressed totals by directory and by file extension;
+- the files that compress worst;
+- duplicate contents, meaning files with the same hash at different paths,
+  and how much space would be saved by storing each blob once. The index
+  locates each file by offset and length, so entries with identical contents
+  can share a single blob;
+- files that can't be reached by searching for their bare names in any of
+  the bundle's search orders, because they're outside of the search path or
+  shadowed by another file of the same name, and how much space dropping them
+  would save. Documents can still ask for such files by a path that ends
+  with their bundle path, so check before removing them.
+
+With `--deep`, a random sample of files is also decompressed and recompressed
+at each gzip level, on a pool of worker processes, to estimate how much
+smaller the bundle would be with different compression settings.
+
+With `--json`, the full results are also written to a file.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+import ttbv1
+import verify
+
+# Files smaller than this are ignored when looking for poor compression,
+# since gzip overhead dominates for them.
+MIN_RATIO_SIZE = 4096
+
+DEEP_LEVELS = [1, 6, 9]
+
+
+def format_size(n_bytes):
+    for unit, scale in (("GiB", 1 << 30), ("MiB", 1 << 20), ("KiB", 1 << 10)):
+        if n_bytes >= scale:
+            return f"{n_bytes / scale:.1f} {unit}"
+
+    return f"{n_bytes} B"
+
+
+def directory_of(path, depth):
+    parts = path.split("/")[:-1]
+    return "/".join(parts[:depth]) or "(top level)"
+
+
+def extension_of(path):
+    name = ttbv1.file_name(path)
+    base, dot, ext = name.rpartition(".")
+    return "." + ext if dot and base else "(none)"
+
+
+def tally(entries, key):
+    """
+    Group *entries* by *key*, returning a list of `(name, n_files,
+    gzip_bytes, real_bytes)` tuples sorted by decreasing compressed size.
+    """
+    totals = {}
+
+    for info in entries:
+        t = totals.setdefault(key(info), [0, 0, 0])
+        t[0] += 1
+        t[1] += info.gzip_len
+        t[2] += info.real_len
+
+    return sorted(
+        ((name, *t) for name, t in totals.items()), key=lambda row: (-row[2], row[0])
+    )
+
+
+def find_duplicates(entries):
+    """
+    Find groups of files with identical contents. Returns a list of
+    `(hash, infos, n_blobs)` tuples sorted by decreasing wasted space, where
+    *n_blobs* is the number of separate blobs currently storing them.
+    """
+    by_hash = {}
+
+    for info in entries:
+        if info.hash is not None:
+            by_hash.setdefault(info.hash, []).append(info)
+
+    groups = []
+
+    for hash, infos in by_hash.items():
+        if len(infos) < 2:
+            continue
+
+        n_blobs = len(set((i.start, i.gzip_len) for i in infos))
+        groups.append((hash, sorted(infos, key=lambda i: i.path), n_blobs))
+
+    groups.sort(key=lambda g: (-wasted_bytes(g), g[0]))
+    return groups
+
+
+def wasted_bytes(group):
+    """
+    Get the space that would be saved by storing a group of duplicates in a
+    single blob.
+    """
+    _, infos, n_blobs = group
+    return (n_blobs - 1) * min(i.gzip_len for i in infos)
+
+
+def recompress_chunk(entries):
+    """
+    Recompress a list of FileInfo records in a worker process, returning a
+    list of `(gzip_len, {level: new_gzip_len})` tuples.
+    """
+    results = []
+
+    for info in entries:
+        with verify.worker_view[info.start : info.start + info.gzip_len] as data:
+            content = ttbv1.decompress(data, info.real_len)
+
+        sizes = {}
+
+        for level in DEEP_LEVELS:
+            c = zlib.compressobj(level, zlib.DEFLATED, ttbv1.GZIP_WBITS)
+            sizes[level] = len(c.compress(content)) + len(c.flush())
+
+        results.append((info.gzip_len, sizes))
+
+    return results
+
+
+def deep_estimate(bundle, entries, settings):
+    """
+    Recompress a random sample of *entries* and extrapolate the total
+    compressed size of the bundle at each level in `DEEP_LEVELS`. Returns a
+    dict mapping levels to estimated totals, and the sample size.
+    """
+    rng = random.Random(settings.seed)
+    sample = rng.sample(entries, min(settings.sample, len(entries)))
+    sample.sort(key=lambda i: i.start)
+    chunks = verify.make_chunks(sample, settings.jobs)
+    old_total = 0
+    new_totals = dict((level, 0) for level in DEEP_LEVELS)
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=settings.jobs,
+        initializer=verify.init_worker,
+        initargs=(bundle.path,),
+    ) as pool:
+        for results in pool.map(recompress_chunk, chunks):
+            for gzip_len, sizes in results:
+                old_total += gzip_len
+
+                for level, size in sizes.items():
+                    new_totals[level] += size
+
+    bundle_total = sum(i.gzip_len for i in entries)
+
+    # This is a ratio estimate: sampled files are scaled up in proportion to
+    # their current compressed size.
+    estimates = dict(
+        (level, round(bundle_total * size / max(old_total, 1)))
+        for level, size in new_totals.items()
+    )
+    return estimates, len(sample)
+
+
+def print_table(title, rows, top):
+    print()
+    print(f"{title:<40} {'files':>8} {'compressed':>12} {'uncompressed':>12} {'ratio':>6}")
+
+    for name, n, gzip_len, real_len in rows[:top]:
+        ratio = gzip_len / real_len if real_len else 1
+        print(
+            f"{name:<40} {n:>8} {format_size(gzip_len):>12} "
+            f"{format_size(real_len):>12} {ratio:>6.2f}"
+        )
+
+    if len(rows) > top:
+        rest = rows[top:]
+        print(
+            f"{'(' + str(len(rest)) + ' more)':<40} {sum(r[1] for r in rest):>8} "
+            f"{format_size(sum(r[2] for r in rest)):>12} "
+            f"{format_size(sum(r[3] for r in rest)):>12}"
+        )
+
+
+def entrypoint(argv):
+    settings = make_arg_parser().parse_args(argv[1:])
+    t0 = time.monotonic()
+
+    try:
+        bundle = ttbv1.TTBv1Bundle(settings.bundle)
+    except (OSError, ttbv1.BundleError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    with bundle:
+        entries = list(bundle)
+        total_gzip = sum(i.gzip_len for i in entries)
+        total_real = sum(i.real_len for i in entries)
+
+        by_dir = tally(entries, lambda i: directory_of(i.path, settings.depth))
+        by_ext = tally(entries, lambda i: extension_of(i.path))
+
+        worst = sorted(
+            (i for i in entries if i.real_len >= MIN_RATIO_SIZE),
+            key=lambda i: (-i.gzip_len / i.real_len, i.path),
+        )
+
+        duplicates = find_duplicates(entries)
+        dup_savings = sum(wasted_bytes(g) for g in duplicates)
+        n_shared = sum(1 for g in duplicates if g[2] < len(g[1]))
+
+        orders = sorted(bundle.search_orders)
+        reachable = bundle.reachable(orders)
+        # Top-level files are the bundle's own metadata, which we need.
+        unreachable = sorted(
+            (i for i in entries if i.path not in reachable and "/" in i.path),
+            key=lambda i: (-i.gzip_len, i.path),
+        )
+        unreachable_gzip = sum(i.gzip_len for i in unreachable)
+        unreachable_real = sum(i.real_len for i in unreachable)
+
+        elapsed = time.monotonic() - t0
+
+        deep = None
+
+        if settings.deep:
+            deep, n_sampled = deep_estimate(bundle, entries, settings)
+
+    print(f"bundle:       {settings.bundle}")
+    print(f"digest:       {bundle.digest}")
+    print(f"files:        {len(entries)}")
+    print(f"compressed:   {format_size(total_gzip)}")
+    print(f"uncompressed: {format_size(total_real)}")
+
+    print_table(f"directory (depth {settings.depth})", by_dir, settings.top)
+    print_table("extension", by_ext, settings.top)
+
+    print()
+    print(f"Worst-compressing files of at least {format_size(MIN_RATIO_SIZE)}:")
+
+    for info in worst[: settings.top]:
+        print(
+            f"  {info.gzip_len / info.real_len:5.2f}  {format_size(info.real_len):>10}  "
+            f"{info.path}"
+        )
+
+    print()
+    print(
+        f"Duplicate contents: {len(duplicates)} groups, "
+        f"{sum(len(g[1]) for g in duplicates)} files"
+    )
+
+    for group in duplicates[: settings.top]:
+        hash, infos, n_blobs = group
+        print(
+            f"  {len(infos)} copies in {n_blobs} blobs, "
+            f"{format_size(wasted_bytes(group))} wasted: {hash[:16]}"
+        )
+
+        for info in infos[:4]:
+            print(f"    {info.path}")
+
+        if len(infos) > 4:
+            print(f"    ... and {len(infos) - 4} more")
+
+    print()
+    print(
+        f"Unreachable by bare name in any search order ({', '.join(orders) or 'none'}): "
+        f"{len(unreachable)} files"
+    )
+
+    for info in unreachable[: settings.top]:
+        print(f"  {format_size(info.gzip_len):>10}  {info.path}")
+
+    if len(unreachable) > settings.top:
+        print(f"  ... and {len(unreachable) - settings.top} more")
+
+    if deep is not None:
+        print()
+        print(f"Recompression estimates from {n_sampled} sampled files:")
+
+        for level, size in sorted(deep.items()):
+            print(
+                f"  gzip -{level}: {format_size(size):>10} "
+                f"({100 * (size - total_gzip) / max(total_gzip, 1):+.1f}%)"
+            )
+
+    if settings.json is not None:
+        results = {
+            "bundle": settings.bundle,
+            "digest": bundle.digest,
+            "files": len(entries),
+            "gzip_bytes": total_gzip,
+            "real_bytes": total_real,
+            "by_directory": by_dir,
+            "by_extension": by_ext,
+            "worst_compression": [i._asdict() for i in worst[: settings.top]],
+            "duplicates": [
+                {
+                    "hash": hash,
+                    "paths": [i.path for i in infos],
+                    "blobs": n_blobs,
+                    "wasted_bytes": wasted_bytes((hash, infos, n_blobs)),
+                }
+                for hash, infos, n_blobs in duplicates
+            ],
+            "unreachable": [i.path for i in unreachable],
+            "unreachable_gzip_bytes": unreachable_gzip,
+            "deep_estimates": deep,
+        }
+
+        with open(settings.json, "wt") as f:
+            json.dump(results, f, indent=1)
+
+    print()
+    print("Summary:")
+    print(f"- Analyzed the index in {elapsed:.2f}s")
+    print(
+        f"- storing each duplicated blob once would save {format_size(dup_savings)} "
+        f"({n_shared} of {len(duplicates)} groups already share blobs)"
+    )
+    print(
+        f"- dropping unreachable files would save {format_size(unreachable_gzip)} "
+        f"compressed, {format_size(unreachable_real)} uncompressed"
+    )
+    if deep is not None:
+        best = min(deep, key=deep.get)
+        print(
+            f"- recompressing at gzip -{best} would save about "
+            f"{format_size(max(total_gzip - deep[best], 0))}"
+        )
+    if settings.json is not None:
+        print(f"- full results written to {settings.json}")
+
+    return 0
+
+
+def make_arg_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "--depth",
+        type=int,
+        default=2,
+        help="Group files by this many leading directories (default: %(default)s)",
+    )
+    p.add_argument(
+        "--top",
+        type=int,
+        default=15,
+        help="Show this many rows in each list (default: %(default)s)",
+    )
+    p.add_argument(
+        "--deep",
+        action="store_true",
+        help="Also estimate the effect of other gzip levels by recompressing a sample",
+    )
+    p.add_argument(
+        "--sample",
+        type=verify.positive_int,
+        default=2000,
+        help="The number of files to recompress with `--deep` (default: %(default)s)",
+    )
+    p.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed for choosing the `--deep` sample",
+    )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=verify.positive_int,
+        default=os.cpu_count() or 1,
+        help="The number of worker processes for `--deep` (default: one per CPU)",
+    )
+    p.add_argument(
+        "--json",
+        metavar="PATH",
+        help="Also write the full results to this JSON file",
+    )
+    p.add_argument(
+        "bundle",
+        help="The path to the `.ttb` bundle to analyze",
+    )
+    return p
+
+
+if __name__ == "__main__":
+    sys.exit(entrypoint(sys.argv))
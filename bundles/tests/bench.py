@@ -0,0 +1,434 @@
+#! /usr/bin/env python3
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2024 the Tectonic Project.
+# Licensed under the MIT License.
+
+"""
+Compare the performance of two `tectonic` binaries on the documents under
+`files/` and `formats/`, using one bundle.
+
+    ./bench.py [options] <tectonic-A> <tectonic-B> <path-to-ttb>
+
+Each binary gets its own warm format cache (see `formatcache.py`) before any
+timing starts. Then every document is compiled `--warmup` times with each
+binary without being timed, and `--runs` times with timing. The two binaries
+take turns on each document, in a random order that is fixed by `--seed`, so
+that slow drift in the machine's state affects both equally. Runs are done
+one at a time so that they don't compete with each other. Wall times come
+from `measure.run_measured()`, which blocks until the compile exits, so they
+carry no polling error and small thresholds are meaningful.
+
+For each document we report the median and 95th-percentile wall time and the
+median peak memory use of each binary, and the ratio of B's median to A's
+with a bootstrap 95% confidence interval. A document is flagged as faster or
+slower when a Mann-Whitney U test finds the difference significant at
+`--alpha` and the change is larger than `--threshold`; otherwise the verdict
+is "same". Memory use gets the same treatment.
+
+All of the measurements and statistics are saved to a JSON file (by default
+`build/bench.json`), so results can be tracked across releases.
+"""
+
+import argparse
+import fnmatch
+import json
+import os.path
+import random
+import shutil
+import statistics
+import sys
+import time
+
+import formatcache
+import measure
+import suite
+import verify
+
+BOOTSTRAP_SAMPLES = 2000
+
+
+def percentile(values, q):
+    """
+    Get the *q*th percentile of *values*, interpolating linearly between
+    data points.
+    """
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def bootstrap_ratio_ci(a, b, rng, level=95):
+    """
+    Get a bootstrap confidence interval for `median(b) / median(a)`.
+    """
+    ratios = []
+
+    for _ in range(BOOTSTRAP_SAMPLES):
+        ma = statistics.median(rng.choices(a, k=len(a)))
+        mb = statistics.median(rng.choices(b, k=len(b)))
+        ratios.append(mb / ma if ma else float("inf"))
+
+    tail = (100 - level) / 2
+    return percentile(ratios, tail), percentile(ratios, 100 - tail)
+
+
+def mann_whitney_p(a, b):
+    """
+    Get the two-sided p-value of a Mann-Whitney U test comparing *a* and *b*,
+    using the normal approximation with a correction for ties. With the
+    sample sizes we use, this is close enough to the exact test.
+    """
+    n1 = len(a)
+    n2 = len(b)
+    combined = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    ranks = [0.0] * len(combined)
+    tie_term = 0
+    i = 0
+
+    while i < len(combined):
+        j = i
+
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+
+        # Tied values share the average of their ranks.
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+
+        t = j - i + 1
+        tie_term += t**3 - t
+        i = j + 1
+
+    r1 = sum(r for r, (_, group) in zip(ranks, combined) if group == 0)
+    u = r1 - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    mean = n1 * n2 / 2
+    var = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+
+    if var <= 0:
+        return 1.0
+
+    z = (abs(u - mean) - 0.5) / var**0.5
+    return min(2 * (1 - statistics.NormalDist().cdf(max(z, 0))), 1.0)
+
+
+def compare(a, b, settings, rng, words=("faster", "slower")):
+    """
+    Compare two lists of measurements, returning a dict of statistics and a
+    verdict: one of *words* if B's values are significantly smaller or
+    larger than A's, or `same`.
+    """
+    ma = statistics.median(a)
+    mb = statistics.median(b)
+    ratio = mb / ma if ma else float("inf")
+    lo, hi = bootstrap_ratio_ci(a, b, rng)
+    p = mann_whitney_p(a, b)
+
+    if p < settings.alpha and abs(ratio - 1) > settings.threshold:
+        verdict = words[1] if ratio > 1 else words[0]
+    else:
+        verdict = "same"
+
+    return {
+        "ratio": round(ratio, 4),
+        "ci95": [round(lo, 4), round(hi, 4)],
+        "p": round(p, 6),
+        "verdict": verdict,
+    }
+
+
+def summarize(records):
+    """
+    Summarize the successful runs among *records*.
+    """
+    wall = [r["wall"] for r in records]
+    rss = [r["maxrss"] for r in records if r["maxrss"] is not None]
+    summary = {
+        "runs": len(records),
+        "wall_median": round(statistics.median(wall), 4),
+        "wall_p95": round(percentile(wall, 95), 4),
+        "wall_min": min(wall),
+    }
+
+    if rss:
+        summary["maxrss_median"] = statistics.median(rss)
+        summary["maxrss_max"] = max(rss)
+
+    return summary
+
+
+class Contender:
+    """
+    One of the two `tectonic` binaries being compared.
+    """
+
+    def __init__(self, label, program, outdir):
+        self.label = label
+        self.program = program
+        self.outdir = os.path.join(outdir, label)
+        self.env = None
+        self.identity = None
+
+    def run(self, case, bundle, timeout):
+        outdir = os.path.join(self.outdir, case.group, case.name)
+        os.makedirs(outdir, exist_ok=True)
+        argv = [self.program, "--chatter", "minimal", "--outdir", outdir]
+        argv += case.args
+        argv += ["--bundle", bundle, case.texpath]
+        return measure.run_measured(
+            argv, os.path.join(outdir, "log.txt"), timeout=timeout, env=self.env
+        )
+
+
+def entrypoint(argv):
+    settings = make_arg_parser().parse_args(argv[1:])
+    settings.bundle = os.path.realpath(settings.bundle)
+    rng = random.Random(settings.seed)
+
+    if settings.runs < 2:
+        print("error: at least 2 timed runs are needed", file=sys.stderr)
+        return 1
+
+    if not 0 < settings.alpha < 1:
+        print("error: the significance level must be between 0 and 1", file=sys.stderr)
+        return 1
+
+    if settings.threshold < 0:
+        print("error: the threshold can't be negative", file=sys.stderr)
+        return 1
+
+    outdir = os.path.join(suite.TEST_DIR, "build", "bench")
+    shutil.rmtree(outdir, ignore_errors=True)
+    os.makedirs(outdir)
+
+    contenders = [
+        Contender("A", settings.program_a, outdir),
+        Contender("B", settings.program_b, outdir),
+    ]
+    cache_root = settings.cache_dir or os.path.join(suite.TEST_DIR, "cache")
+
+    for c in contenders:
+        try:
+            c.env, record = formatcache.prepare(
+                c.program, settings.bundle, cache_root, timeout=settings.timeout
+            )
+            c.identity = formatcache.program_identity(c.program)
+        except (OSError, RuntimeError) as e:
+            print(f"error: {c.label}: {e}", file=sys.stderr)
+            return 1
+
+        if record is not None:
+            print(f"note: built the LaTeX format for {c.label} in {record['wall']:.1f}s")
+
+    if contenders[0].identity == contenders[1].identity:
+        print("note: A and B are the same binary; this is an A/A test")
+
+    # The cases from the test suite, compiled into our own output directories.
+    cases = suite.make_file_cases(outdir)
+
+    if settings.only:
+        cases = [
+            c for c in cases if any(fnmatch.fnmatch(c.id, p) for p in settings.only)
+        ]
+
+    if not cases:
+        print("error: no documents selected", file=sys.stderr)
+        return 1
+
+    n_rounds = settings.warmup + settings.runs
+    print(
+        f"note: {len(cases)} documents, {settings.warmup} warm-up and "
+        f"{settings.runs} timed runs each, {2 * len(cases) * n_rounds} compiles"
+    )
+
+    records = dict(((c.id, x.label), []) for c in cases for x in contenders)
+    t0 = time.monotonic()
+
+    with measure.Report(os.path.join(outdir, "report.jsonl")) as report:
+        for i in range(n_rounds):
+            timed = i >= settings.warmup
+
+            for case in cases:
+                order = list(contenders)
+                rng.shuffle(order)
+
+                for c in order:
+                    record = c.run(case, settings.bundle, settings.timeout)
+                    report.add(
+                        case.id, record, binary=c.label, round=i, timed=timed
+                    )
+
+                    if timed:
+                        records[case.id, c.label].append(record)
+
+            label = "warm-up" if not timed else "timed"
+            print(
+                f"\r{i + 1}/{n_rounds} rounds ({label}), "
+                f"{time.monotonic() - t0:.0f}s elapsed\033[K",
+                end="",
+                file=sys.stderr,
+                flush=True,
+            )
+
+    print(file=sys.stderr)
+
+    documents = []
+    n_slower = 0
+    n_faster = 0
+    n_broken = 0
+
+    print()
+    print(
+        f"{'document':<36} {'A median':>9} {'B median':>9} {'B p95':>8} "
+        f"{'B/A':>6} {'95% CI':>13} {'time':>7} {'memory':>7}"
+    )
+
+    for case in cases:
+        doc = {"id": case.id}
+        ok = {}
+
+        for c in contenders:
+            runs = records[case.id, c.label]
+            good = [r for r in runs if r["status"] == 0]
+            doc[c.label] = {
+                "wall": [r["wall"] for r in runs],
+                "cpu": [r["cpu"] for r in runs],
+                "maxrss": [r["maxrss"] for r in runs],
+                "status": [r["status"] for r in runs],
+            }
+
+            if good:
+                doc[c.label]["summary"] = summarize(good)
+
+            ok[c.label] = good
+
+        if len(ok["A"]) < 2 or len(ok["B"]) < 2:
+            # Not enough successful runs to compare. Differences in whether
+            # a document compiles at all are for the test suite to catch.
+            doc["verdict"] = "broken"
+            n_broken += 1
+            print(f"{case.id:<36} {'(too many failed runs)':>50}")
+            documents.append(doc)
+            continue
+
+        doc["wall"] = compare(
+            [r["wall"] for r in ok["A"]], [r["wall"] for r in ok["B"]], settings, rng
+        )
+        rss_a = [r["maxrss"] for r in ok["A"] if r["maxrss"] is not None]
+        rss_b = [r["maxrss"] for r in ok["B"] if r["maxrss"] is not None]
+
+        if len(rss_a) >= 2 and len(rss_b) >= 2:
+            doc["maxrss"] = compare(
+                rss_a, rss_b, settings, rng, words=("smaller", "larger")
+            )
+
+        doc["verdict"] = doc["wall"]["verdict"]
+        n_slower += doc["verdict"] == "slower"
+        n_faster += doc["verdict"] == "faster"
+        documents.append(doc)
+
+        sa = doc["A"]["summary"]
+        sb = doc["B"]["summary"]
+        lo, hi = doc["wall"]["ci95"]
+        print(
+            f"{case.id:<36} {sa['wall_median']:>8.2f}s {sb['wall_median']:>8.2f}s "
+            f"{sb['wall_p95']:>7.2f}s {doc['wall']['ratio']:>6.3f} "
+            f"{f'{lo:.3f}-{hi:.3f}':>13} {doc['verdict']:>7} "
+            f"{doc.get('maxrss', {}).get('verdict', '-'):>7}"
+        )
+
+    results = {
+        "bundle": settings.bundle,
+        "bundle_digest": formatcache.bundle_digest(settings.bundle),
+        "binaries": dict(
+            (c.label, {"program": c.program, "identity": c.identity})
+            for c in contenders
+        ),
+        "settings": {
+            "runs": settings.runs,
+            "warmup": settings.warmup,
+            "seed": settings.seed,
+            "alpha": settings.alpha,
+            "threshold": settings.threshold,
+        },
+        "documents": documents,
+    }
+
+    with open(settings.output, "wt") as f:
+        json.dump(results, f, indent=1)
+
+    print()
+    print("Summary:")
+    print(f"- Benchmarked {len(cases)} documents in {time.monotonic() - t0:.0f}s")
+    print(f"- B is slower on {n_slower}, faster on {n_faster}")
+    if n_broken:
+        print(f"- {n_broken} documents had too many failed runs to compare")
+    print(f"- results saved to {settings.output}")
+
+    return 1 if n_slower else 0
+
+
+def make_arg_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "--runs",
+        type=int,
+        default=10,
+        help="The number of timed runs per document and binary (default: %(default)s)",
+    )
+    p.add_argument(
+        "--warmup",
+        type=verify.non_negative_int,
+        default=1,
+        help="The number of untimed runs first (default: %(default)s)",
+    )
+    p.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed for the run order and bootstrap (default: %(default)s)",
+    )
+    p.add_argument(
+        "--alpha",
+        type=float,
+        default=0.01,
+        help="Significance level for flagging a change (default: %(default)s)",
+    )
+    p.add_argument(
+        "--threshold",
+        type=float,
+        default=0.03,
+        help="Ignore changes smaller than this fraction (default: %(default)s)",
+    )
+    p.add_argument(
+        "--only",
+        action="append",
+        metavar="PATTERN",
+        help="Only benchmark documents whose ID (like `files/chess.tex`) matches this glob; may be repeated",
+    )
+    p.add_argument(
+        "--timeout",
+        type=verify.positive_float,
+        default=300,
+        help="Kill and fail any compile that runs longer than this many seconds",
+    )
+    p.add_argument(
+        "--cache-dir",
+        help="Where to keep the warm Tectonic caches (default: `cache/` next to this script)",
+    )
+    p.add_argument(
+        "-o",
+        "--output",
+        default=os.path.join(suite.TEST_DIR, "build", "bench.json"),
+        help="Where to save the results (default: `build/bench.json`)",
+    )
+    p.add_argument("program_a", metavar="tectonic-A", help="The baseline binary")
+    p.add_argument("program_b", metavar="tectonic-B", help="The binary to compare")
+    p.add_argument("bundle", help="The path to the `.ttb` bundle to use")
+    return p
+
+
+if __name__ == "__main__":
+    sys.exit(entrypoint(sys.argv))
@@ -0,0 +1,312 @@
+#! /usr/bin/env python3
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2024 the Tectonic Project.
+# Licensed under the MIT License.
+
+"""
+Compare two TTBv1 bundles using only their headers and indexes.
+
+Every `[FILELIST]` entry records the hash and length of a file, so we can tell
+what changed between two bundles without decompressing any of their contents.
+Files are reported as:
+
+- added or removed;
+- modified, if their hash changed;
+- moved, if a removed file and an added file have the same hash. If several
+  files share a hash, moves between files with the same name are preferred.
+
+Files stored with `nohash` (`FILELIST` and `SHA256SUM`) are derived from the
+rest of the bundle, so they count as modified whenever the bundle hash changes.
+
+We also summarize how the file count and sizes changed in each top-level
+directory, and show changes to the search orders.
+
+With `-o`, the changed paths are written out in the style of `git diff
+--name-status`: one per line, as `A\t<path>`, `D\t<path>`, `M\t<path>`, or
+`R\t<old>\t<new>`.
+"""
+
+import argparse
+import difflib
+import sys
+import time
+
+import ttbv1
+
+ROOT_GROUP = "(top level)"
+
+
+class BundleDiff:
+    """
+    The differences between two bundles.
+
+    Attributes:
+
+    - `added`, `removed`, `modified`: sorted lists of paths
+    - `moved`: a sorted list of `(old_path, new_path)` tuples
+    - `groups`: a dict mapping top-level directories to `(old, new)` tuples of
+      `(n_files, gzip_bytes, real_bytes)` totals
+    """
+
+    def __init__(self, old, new):
+        self.old_digest = old.digest
+        self.new_digest = new.digest
+        self.removed = []
+        self.modified = []
+        self.moved = []
+
+        for path, info in old.files.items():
+            other = new.files.get(path)
+
+            if other is None:
+                self.removed.append(path)
+            elif info.hash != other.hash or (
+                info.hash is None and old.digest != new.digest
+            ):
+                self.modified.append(path)
+
+        self.added = [path for path in new.files if path not in old.files]
+        self._find_moves(old, new)
+
+        self.added.sort()
+        self.removed.sort()
+        self.modified.sort()
+        self.moved.sort()
+
+        self.groups = {}
+
+        for index, bundle in enumerate((old, new)):
+            for info in bundle:
+                totals = self.groups.setdefault(top_level(info.path), [[0, 0, 0], [0, 0, 0]])
+                t = totals[index]
+                t[0] += 1
+                t[1] += info.gzip_len
+                t[2] += info.real_len
+
+        self.groups = dict(
+            (name, (tuple(a), tuple(b))) for name, (a, b) in self.groups.items()
+        )
+
+        self.search_changes = diff_search(old, new)
+
+    def _find_moves(self, old, new):
+        removed_by_hash = {}
+        added_by_hash = {}
+
+        for path in sorted(self.removed):
+            h = old.files[path].hash
+            if h is not None:
+                removed_by_hash.setdefault(h, []).append(path)
+
+        for path in sorted(self.added):
+            h = new.files[path].hash
+            if h is not None:
+                added_by_hash.setdefault(h, []).append(path)
+
+        for h, sources in removed_by_hash.items():
+            dests = added_by_hash.get(h)
+
+            if not dests:
+                continue
+
+            # Pair up files that kept their names first, then whatever is left
+            # in order.
+            for src in list(sources):
+                for dest in dests:
+                    if ttbv1.file_name(src) == ttbv1.file_name(dest):
+                        self.moved.append((src, dest))
+                        sources.remove(src)
+                        dests.remove(dest)
+                        break
+
+            for src, dest in zip(list(sources), list(dests)):
+                self.moved.append((src, dest))
+                sources.remove(src)
+                dests.remove(dest)
+
+        moved_from = set(src for src, _ in self.moved)
+        moved_to = set(dest for _, dest in self.moved)
+        self.removed = [p for p in self.removed if p not in moved_from]
+        self.added = [p for p in self.added if p not in moved_to]
+
+    @property
+    def identical(self):
+        return self.old_digest == self.new_digest and not self.search_changes
+
+    def name_status(self):
+        """
+        Get the changes as `(status, path, ...)` tuples sorted by path, where
+        *status* is `A`, `D`, `M` or `R`.
+        """
+        items = [("A", p) for p in self.added]
+        items += [("D", p) for p in self.removed]
+        items += [("M", p) for p in self.modified]
+        items += [("R", src, dest) for src, dest in self.moved]
+        items.sort(key=lambda item: item[1:])
+        return items
+
+    def changed_paths(self):
+        """
+        Get the set of paths in either bundle whose contents may differ
+        between the two.
+        """
+        paths = set(self.added) | set(self.removed) | set(self.modified)
+
+        for src, dest in self.moved:
+            paths.add(src)
+            paths.add(dest)
+
+        return paths
+
+
+def top_level(path):
+    head, sep, _ = path.partition("/")
+    return head if sep else ROOT_GROUP
+
+
+def diff_search(old, new):
+    """
+    Compare the search orders of two bundles, returning a list of lines
+    describing the changes.
+    """
+    lines = []
+
+    if old.default_search != new.default_search:
+        lines.append(
+            f"default search order: {old.default_search} -> {new.default_search}"
+        )
+
+    for name in sorted(old.search_orders.keys() | new.search_orders.keys()):
+        a = old.search_orders.get(name)
+        b = new.search_orders.get(name)
+
+        if a == b:
+            continue
+
+        if a is None:
+            lines.append(f"added search order {name}")
+        elif b is None:
+            lines.append(f"removed search order {name}")
+        else:
+            lines.append(f"changed search order {name}:")
+            lines += [
+                "  " + line
+                for line in difflib.unified_diff(a, b, n=1, lineterm="")
+                if not line.startswith(("---", "+++"))
+            ]
+
+    return lines
+
+
+def format_delta(n):
+    return f"{n:+d}" if n else "0"
+
+
+def format_size(n_bytes):
+    for unit, scale in (("GiB", 1 << 30), ("MiB", 1 << 20), ("KiB", 1 << 10)):
+        if abs(n_bytes) >= scale:
+            return f"{n_bytes / scale:+.1f} {unit}"
+
+    return f"{n_bytes:+d} B" if n_bytes else "0"
+
+
+def print_report(diff, settings):
+    if diff.old_digest == diff.new_digest:
+        print(f"bundle hash: {diff.old_digest} (unchanged)")
+    else:
+        print(f"bundle hash: {diff.old_digest} -> {diff.new_digest}")
+
+    if settings.verbose:
+        for status, *paths in diff.name_status():
+            print(status, " -> ".join(paths))
+
+    changed_groups = [
+        (name, a, b) for name, (a, b) in sorted(diff.groups.items()) if a != b
+    ]
+
+    if changed_groups:
+        print()
+        print(f"{'directory':<20} {'files':>8} {'compressed':>14} {'uncompressed':>14}")
+
+        for name, a, b in changed_groups:
+            print(
+                f"{name:<20} {format_delta(b[0] - a[0]):>8} "
+                f"{format_size(b[1] - a[1]):>14} {format_size(b[2] - a[2]):>14}"
+            )
+
+    if diff.search_changes:
+        print()
+
+        for line in diff.search_changes:
+            print(line)
+
+
+def write_name_status(diff, f):
+    for item in diff.name_status():
+        print("\t".join(item), file=f)
+
+
+def entrypoint(argv):
+    settings = make_arg_parser().parse_args(argv[1:])
+    t0 = time.monotonic()
+
+    try:
+        with ttbv1.TTBv1Bundle(settings.old) as old, ttbv1.TTBv1Bundle(
+            settings.new
+        ) as new:
+            diff = BundleDiff(old, new)
+    except (OSError, ttbv1.BundleError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    elapsed = time.monotonic() - t0
+    print_report(diff, settings)
+
+    if settings.output == "-":
+        write_name_status(diff, sys.stdout)
+    elif settings.output is not None:
+        with open(settings.output, "wt") as f:
+            write_name_status(diff, f)
+
+    print()
+    print("Summary:")
+    print(f"- Compared indexes in {elapsed:.3f}s")
+
+    if diff.identical:
+        print("- bundles are identical")
+        return 0
+
+    print(
+        f"- {len(diff.added)} added, {len(diff.removed)} removed, "
+        f"{len(diff.modified)} modified, {len(diff.moved)} moved"
+    )
+    if diff.search_changes:
+        print("- search orders changed")
+    if settings.output not in (None, "-"):
+        print(f"- changed paths written to {settings.output}")
+
+    return 0
+
+
+def make_arg_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="List every changed file",
+    )
+    p.add_argument(
+        "-o",
+        "--output",
+        metavar="PATH",
+        help="Write the changed paths to this file in `git diff --name-status` "
+        "format (`-` for standard output)",
+    )
+    p.add_argument("old", help="The path to the old `.ttb` bundle")
+    p.add_argument("new", help="The path to the new `.ttb` bundle")
+    return p
+
+
+if __name__ == "__main__":
+    sys.exit(entrypoint(sys.argv))
@@ -0,0 +1,152 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2024 the Tectonic Project.
+# Licensed under the MIT License.
+
+"""
+A warm Tectonic cache shared by all of the compiles in a test run.
+
+Tectonic keeps generated format files in the `formats` subdirectory of its
+cache directory, which can be set with `$TECTONIC_CACHE_DIR`. If every compile
+in a run used the user's default cache, results would depend on whatever
+happened to be in it, and parallel workers starting on a cold cache would all
+race to generate the same format.
+
+Instead, the test harnesses call `prepare()` once before running any tests. It
+picks a cache directory keyed on the bundle hash and the identity of the
+`tectonic` binary, and if that cache doesn't have a LaTeX format yet, it
+compiles a minimal document to build one. Since the engine generates the
+format from the bundle's `tectonic-format-latex.tex`, this is the same work as
+the `formats/format-latex.tex` test case, but the result lands in the cache.
+The format file is then made read-only and every later compile uses it
+through the environment returned by `prepare()`, so the timings of those
+compiles don't include format generation.
+"""
+
+import glob
+import hashlib
+import os
+import re
+import shutil
+import zipfile
+
+import measure
+import ttbv1
+
+# The file in zip bundles holding the digest of the bundle contents.
+DIGEST_NAME = "SHA256SUM"
+
+WARMUP_DOCUMENT = r"""\documentclass{article}
+\begin{document}
+Hello, world.
+\end{document}
+"""
+
+
+def sha256_file(f):
+    h = hashlib.sha256()
+
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+        h.update(chunk)
+
+    return h.hexdigest()
+
+
+def bundle_digest(path):
+    """
+    Get the digest that the engine uses to name the format files it builds
+    from the bundle at *path*. For TTBv1 bundles this is the hash stored in
+    the header. For zip bundles it's read from the bundle's `SHA256SUM` file,
+    the same way as in `crates/bundles/src/zip.rs`. Raises
+    `ttbv1.BundleError` for anything else.
+    """
+    with open(path, "rb") as f:
+        try:
+            return ttbv1.parse_header(f.read(ttbv1.HEADER_SIZE))[3]
+        except ttbv1.BundleError:
+            pass
+
+    try:
+        with zipfile.ZipFile(path) as z:
+            with z.open(DIGEST_NAME) as f:
+                text = f.read(64).decode("ascii")
+    except (zipfile.BadZipFile, KeyError, UnicodeDecodeError):
+        raise ttbv1.BundleError(
+            f"{path} is neither a TTBv1 bundle nor a zip bundle with a {DIGEST_NAME} file"
+        ) from None
+
+    if not re.fullmatch(r"[0-9a-fA-F]{64}", text):
+        raise ttbv1.BundleError(f"corrupted {DIGEST_NAME} in {path}")
+
+    return text.lower()
+
+
+def program_identity(program):
+    """
+    Get a hex digest identifying the binary that will be run for *program*,
+    or raise FileNotFoundError if it can't be found.
+    """
+    path = shutil.which(program)
+    if path is None:
+        raise FileNotFoundError(f"cannot find the program {program!r}")
+
+    with open(path, "rb") as f:
+        return sha256_file(f)
+
+
+def cached_formats(cachedir, digest):
+    return glob.glob(os.path.join(cachedir, "formats", f"{digest}-latex-*.fmt"))
+
+
+def prepare(program, bundle_path, cache_root, timeout=None, report=None):
+    """
+    Make sure that there's a warm cache for running *program* with the bundle
+    at *bundle_path*, under *cache_root*.
+
+    Returns a tuple of `(env, record)`. *env* is the environment to use for
+    compiles. *record* is the measurement record of the format build, or None
+    if the cache was already warm. If *report* is given, the record is also
+    added to it. Raises RuntimeError if the bundle isn't recognized or the
+    format can't be built.
+    """
+    try:
+        digest = bundle_digest(bundle_path)
+    except ttbv1.BundleError as e:
+        raise RuntimeError(str(e)) from None
+
+    engine = program_identity(program)
+    cachedir = os.path.abspath(os.path.join(cache_root, digest, engine[:16]))
+    env = dict(os.environ, TECTONIC_CACHE_DIR=cachedir)
+
+    if cached_formats(cachedir, digest):
+        return env, None
+
+    workdir = os.path.join(cachedir, "warmup")
+    os.makedirs(workdir, exist_ok=True)
+    texpath = os.path.join(workdir, "warmup.tex")
+
+    with open(texpath, "wt") as f:
+        f.write(WARMUP_DOCUMENT)
+
+    record = measure.run_measured(
+        [program, "-b", bundle_path, texpath],
+        os.path.join(workdir, "log.txt"),
+        timeout=timeout,
+        env=env,
+    )
+
+    if report is not None:
+        report.add("format:latex", record, kind="format")
+
+    formats = cached_formats(cachedir, digest)
+
+    if record["status"] != 0 or not formats:
+        raise RuntimeError(
+            f"failed to build the LaTeX format; see {os.path.join(workdir, 'log.txt')}"
+        )
+
+    # Nothing after this point should need to modify the format. If something
+    # tries, we'd rather hear about it than have it silently skew timings.
+    for path in formats:
+        os.chmod(path, 0o444)
+
+    return env, record
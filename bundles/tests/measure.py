@@ -0,0 +1,323 @@
+#! /usr/bin/env python3
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2024 the Tectonic Project.
+# Licensed under the MIT License.
+
+"""
+Measure the resource usage of test compiles, and compare the results of
+different test runs.
+
+Each compile is described by a JSON record holding its name, exit status,
+wall-clock time, CPU time (user plus system) and peak resident set size of the
+child process, and the size of its log. Reports are JSONL files containing one
+such record per line.
+
+Commands:
+
+- `run`: run one command, appending its record to a report. This is handy
+  for measuring one-off compiles from the shell.
+- `compare`: compare two reports, flagging compiles that got slower or
+  bigger by more than a threshold factor.
+
+The same functionality is available to other scripts through `run_measured()`
+and `Report`.
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# On Linux `ru_maxrss` is in kibibytes; on macOS it's in bytes.
+MAXRSS_SCALE = 1 if sys.platform == "darwin" else 1024
+
+
+def run_measured(argv, logpath, timeout=None, env=None, cwd=None):
+    """
+    Run *argv* with its output sent to the file *logpath*, returning a dict
+    describing its resource usage. The `status` item is the exit code, or
+    None if the program was killed after running for more than *timeout*
+    seconds.
+
+    CPU time and peak memory come from the `wait4()` resource usage of the
+    child, and are None on platforms that don't provide it.
+    """
+    t0 = time.monotonic()
+    timed_out = False
+    usage = None
+
+    with open(logpath, "wb") as log:
+        proc = subprocess.Popen(
+            argv,
+            shell=False,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env=env,
+            cwd=cwd,
+        )
+
+        if not hasattr(os, "wait4") or not hasattr(os, "waitid"):
+            try:
+                proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+                timed_out = True
+
+            t1 = time.monotonic()
+        else:
+            # Block until the child exits, so that the wall time is exact,
+            # and enforce the timeout from a timer thread. The timer only
+            # sends a signal. We wait with WNOWAIT and only reap the child
+            # once the timer can no longer fire, so its PID can't have been
+            # reused by the time it's signaled.
+            lock = threading.Lock()
+            exited = False
+
+            def kill():
+                nonlocal timed_out
+
+                with lock:
+                    if not exited:
+                        os.kill(proc.pid, signal.SIGKILL)
+                        timed_out = True
+
+            timer = None
+
+            if timeout is not None:
+                timer = threading.Timer(timeout, kill)
+                timer.daemon = True
+                timer.start()
+
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            t1 = time.monotonic()
+
+            with lock:
+                exited = True
+
+            if timer is not None:
+                timer.cancel()
+
+            _, wstatus, usage = os.wait4(proc.pid, 0)
+
+            # Let the Popen object know that the child has been reaped.
+            proc.returncode = os.waitstatus_to_exitcode(wstatus)
+
+    record = {
+        "status": None if timed_out else proc.returncode,
+        "wall": round(t1 - t0, 4),
+        "cpu": None,
+        "maxrss": None,
+        "log_bytes": os.path.getsize(logpath),
+    }
+
+    if usage is not None:
+        record["cpu"] = round(usage.ru_utime + usage.ru_stime, 4)
+        record["maxrss"] = usage.ru_maxrss * MAXRSS_SCALE
+
+    return record
+
+
+class Report:
+    """
+    A JSONL report of compile records, written as they come in. Records may
+    be added from multiple threads.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.lock = threading.Lock()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.file = open(path, "at" if append else "wt")
+
+    def add(self, name, record, **extra):
+        item = {"name": name}
+        item.update(record)
+        item.update(extra)
+        text = json.dumps(item, sort_keys=True)
+
+        with self.lock:
+            print(text, file=self.file, flush=True)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_report(path):
+    """
+    Load a report as a dict mapping names to records. If a name appears more
+    than once, the last record wins.
+    """
+    records = {}
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+
+            if line:
+                item = json.loads(line)
+                records[item["name"]] = item
+
+    return records
+
+
+def compare_reports(old, new, settings):
+    """
+    Compare two loaded reports. Returns a list of `(name, message)` tuples
+    describing regressions.
+    """
+    regressions = []
+
+    for name in sorted(old.keys() & new.keys()):
+        a = old[name]
+        b = new[name]
+
+        if a["status"] == 0 and b["status"] != 0:
+            regressions.append((name, f"now fails (status {b['status']})"))
+            continue
+
+        for key, threshold, floor, unit, scale in (
+            ("wall", settings.time_factor, settings.min_time, "s", 1),
+            ("cpu", settings.time_factor, settings.min_time, "s", 1),
+            ("maxrss", settings.rss_factor, settings.min_rss, "MiB", 1048576),
+        ):
+            va = a.get(key)
+            vb = b.get(key)
+
+            if va is None or vb is None or vb < floor:
+                continue
+
+            if vb > threshold * max(va, 1e-9):
+                regressions.append(
+                    (
+                        name,
+                        f"{key} {va / scale:.2f}{unit} -> {vb / scale:.2f}{unit} "
+                        f"({vb / max(va, 1e-9):.1f}x)",
+                    )
+                )
+
+    return regressions
+
+
+def do_run(settings):
+    if settings.command[:1] == ["--"]:
+        settings.command = settings.command[1:]
+
+    if not settings.command:
+        die("no command given to run")
+
+    record = run_measured(settings.command, settings.log, timeout=settings.timeout)
+
+    with Report(settings.report, append=True) as report:
+        report.add(settings.name, record)
+
+    return 1 if record["status"] is None else record["status"]
+
+
+def do_compare(settings):
+    old = load_report(settings.old)
+    new = load_report(settings.new)
+    regressions = compare_reports(old, new, settings)
+
+    for name, message in regressions:
+        print(f"REGRESSED {name}: {message}")
+
+    def total(records, key):
+        return sum(r.get(key) or 0 for r in records.values())
+
+    common = old.keys() & new.keys()
+    print()
+    print("Summary:")
+    print(f"- {len(common)} compiles in both reports")
+    if old.keys() - new.keys():
+        print(f"- {len(old.keys() - new.keys())} only in the old report")
+    if new.keys() - old.keys():
+        print(f"- {len(new.keys() - old.keys())} only in the new report")
+    print(
+        f"- total wall time {total(old, 'wall'):.1f}s -> {total(new, 'wall'):.1f}s, "
+        f"CPU time {total(old, 'cpu'):.1f}s -> {total(new, 'cpu'):.1f}s"
+    )
+
+    if regressions:
+        print(f"- {len(regressions)} regressions")
+        return 1
+
+    print("- no regressions")
+    return 0
+
+
+def die(message):
+    print(f"error: {message}", file=sys.stderr)
+    sys.exit(1)
+
+
+def entrypoint(argv):
+    settings = make_arg_parser().parse_args(argv[1:])
+    return settings.func(settings)
+
+
+def make_arg_parser():
+    p = argparse.ArgumentParser()
+    commands = p.add_subparsers(dest="subcommand", required=True)
+
+    sp = commands.add_parser("run", help="Run and measure one command")
+    sp.set_defaults(func=do_run)
+    sp.add_argument(
+        "--report", required=True, help="The report file to append the record to"
+    )
+    sp.add_argument("--name", required=True, help="The name of this compile")
+    sp.add_argument("--log", required=True, help="Where to save the command output")
+    sp.add_argument(
+        "--timeout",
+        type=float,
+        help="Kill the command if it runs longer than this many seconds",
+    )
+    sp.add_argument("command", nargs=argparse.REMAINDER, help="The command to run")
+
+    sp = commands.add_parser("compare", help="Compare two reports")
+    sp.set_defaults(func=do_compare)
+    sp.add_argument(
+        "--time-factor",
+        type=float,
+        default=1.5,
+        help="Flag compiles whose time grew by more than this factor",
+    )
+    sp.add_argument(
+        "--rss-factor",
+        type=float,
+        default=1.5,
+        help="Flag compiles whose peak memory grew by more than this factor",
+    )
+    sp.add_argument(
+        "--min-time",
+        type=float,
+        default=0.5,
+        help="Ignore times below this many seconds, which are mostly noise",
+    )
+    sp.add_argument(
+        "--min-rss",
+        type=int,
+        default=16 * 1048576,
+        help="Ignore peak memory use below this many bytes",
+    )
+    sp.add_argument("old", help="The baseline report")
+    sp.add_argument("new", help="The report to check")
+    return p
+
+
+if __name__ == "__main__":
+    sys.exit(entrypoint(sys.argv))
@@ -26,15 +26,102 @@ reasonable. In particular:
 - The default `-S` setting is 5%, which tests about 150 packages and takes about
   7 minutes to run. The default `-K` setting is random.
 
+The `-j` option compiles that many packages in parallel. Each result is
+printed as soon as it's known, so a regression in a package that is compiled
+early shows up right away. Since the order of these lines depends on the
+timing and the amount of parallelism, all of the outcomes other than expected
+passes are listed again in sorted order at the end, to make runs easy to
+compare.
+
+The outcome and duration of each package's latest compile are saved in
+`packages-history.json` in the test output directory, and used to plan the
+next run:
+
+- Packages that are new to `packages.txt`, or that unexpectedly failed or hung
+  last time, are compiled first, so that regressions show up early.
+
+- The rest are compiled longest first, so that slow packages don't end up
+  running alone at the end while the other jobs sit idle.
+
+- A compile is killed if it runs for more than `--timeout-factor` times as
+  long as it did last time (but at least 30 seconds), or for more than
+  `--timeout` seconds. Packages that didn't pass last time, or that have no
+  history, just get `--timeout`. Killed compiles are reported as hangs rather
+  than failures, and don't change a package's tags in update mode.
+
+The `-B` option loads up to that many packages in a single test document, to
+amortize the engine's startup time. If a batch fails, it is split in half and
+each half is retried, until each failure is isolated in a single-package
+compile. Packages marked `xfail`, and new packages in update mode, are always
+tested on their own, so that their tags come from a single-package compile.
+
+Batching has two caveats. First, a package that only works if some other
+package is loaded before it will pass in a batch that happens to contain that
+package, even though it would fail on its own. Second, packages that pass in a
+batch don't get their own output directory: the document and log are under
+`batches/` in the test output directory.
+
+The wall time, CPU time, peak memory use, exit status and log size of every
+compile are saved to `packages-report.jsonl` in the test output directory.
+Use `measure.py compare` to look for regressions between two such reports.
+
+Before any packages are tested, the LaTeX format is built once into a cache
+directory keyed on the bundle hash and the `tectonic` binary (see
+`formatcache.py`), and all of the test compiles reuse it. The time taken to
+build the format is reported separately. Use `--cache-dir` to share this cache
+with other test runs.
+
+Results are cached in `packages-cache.json` in the test output directory,
+keyed on the bundle hash, the identity of the `tectonic` binary, and the exact
+test document. Packages whose key hasn't changed since a previous run aren't
+recompiled, so repeated `--update` runs with different sample keys gradually
+cover the whole corpus. Use `--no-cache` to force every package to be rebuilt.
+A pass from a batch is only reused when the package is batched again, so
+packages that are tested on their own, as with `-B 1`, are always compiled on
+their own at least once.
+The log of each cached result is copied to `packages-cache-logs`, since the
+per-package output directories are overwritten by later runs.
+
+Each compile also records which bundle files it opened, picked out of the TeX
+log and resolved with the bundle's search order (see `ttbv1.py`). These are
+saved in `packages-deps.json` in the test output directory, as a reverse index
+mapping each bundle path and content hash to the packages that used it. Files
+loaded by the engine outside of TeX's file-opening messages, such as font
+metrics, aren't seen. Packages that passed together in a batch are all
+recorded as using everything the batch opened. Cached results keep the inputs
+of the compile they came from. Inputs can only be resolved against TTBv1
+bundles; with other bundles, nothing is recorded.
+
+With `--changed-since <old.ttb>`, the random sampling is replaced by change-
+impact selection: the indexes of the old and new bundles are compared (see
+`diff.py`) and only the packages whose recorded inputs were modified, removed,
+or may now be shadowed by a new file of the same name are tested, along with
+any packages that have no recorded inputs yet. Since we can't see what goes
+into the LaTeX format, a change to one of its likely sources, or to the search
+order, selects every package. This mode needs both bundles to be TTBv1.
+
+In any mode, packages without recorded inputs are compiled before others with
+the same priority.
 """
 
 import argparse
+import concurrent.futures
+import fnmatch
+import hashlib
+import json
 import os.path
 import random
-import subprocess
+import re
+import shutil
 import sys
+import threading
 
 from test_utils import *
+import diff
+import formatcache
+import measure
+import ttbv1
+import verify
 
 # We use percent formatting since all the TeX braces would be super annoying to
 # escape in str.format() formatting.
@@ -45,6 +132,33 @@ DOCUMENT_BODY = r"""\begin{document}
 Hello, world.
 \end{document}"""
 
+# TeX logs `(<name>` when it opens an input file, and breaks log lines at this
+# many characters.
+LOG_OPEN_RE = re.compile(r"\(([^()\s]+)")
+MAX_PRINT_LINE = 79
+
+# The LaTeX format is built inside the engine, so its inputs never show up in
+# the logs of the test compiles. If a file matching one of these names
+# changes, the format probably did too, and every package is affected.
+FORMAT_SOURCES = [
+    "tectonic-format-*.tex",
+    "*.ltx",
+    "*.ini",
+    "hyphen.cfg",
+    "language.dat",
+    "language.def",
+    "hyph-*.tex",
+    "loadhyph-*.tex",
+    "fonttext.cfg",
+    "fontmath.cfg",
+    "preload.cfg",
+    "texsys.cfg",
+]
+
+# Adaptive timeouts never go below this many seconds, to allow for noise in
+# the timings of quick compiles.
+MIN_TIMEOUT = 30
+
 
 def entrypoint(argv):
     settings = make_arg_parser().parse_args(argv[1:])
@@ -58,9 +172,18 @@ def entrypoint(argv):
     n_missing = 0
     n_removed = 0
     n_xfail = 0
+    n_cached = 0
+    n_unaffected = 0
+    n_hangs = 0
 
     # Random sampling setup
 
+    if settings.timeout <= 0:
+        die("the timeout must be positive")
+
+    if settings.timeout_factor < 0:
+        die("the timeout factor can't be negative")
+
     if settings.sample_key is None:
         settings.sample_key = random.randint(0, 99)
 
@@ -130,9 +253,48 @@ def entrypoint(argv):
     if n_missing + n_removed > 0:
         print("NOTE: use --update to rebuild packages.txt if needed")
 
+    # Load the recorded inputs of each package, and the bundle to resolve
+    # the names of new ones against.
+
+    deps = DependencyIndex(bundle.test_path("packages-deps.json"))
+
+    try:
+        ttb = ttbv1.TTBv1Bundle(bundle.zip_path())
+    except ttbv1.BundleError as e:
+        if settings.changed_since is not None:
+            die(f"`--changed-since` needs a TTBv1 bundle: {e}")
+
+        print(f"note: not recording package inputs ({e})")
+        ttb = None
+    except OSError as e:
+        die(f"cannot open the bundle: {e}")
+
+    affected = None
+
+    if settings.changed_since is not None:
+        try:
+            with ttbv1.TTBv1Bundle(settings.changed_since) as old:
+                changes = diff.BundleDiff(old, ttb)
+        except (OSError, ttbv1.BundleError) as e:
+            die(f"cannot open the old bundle: {e}")
+
+        affected, reason = deps.affected(changes, ttb)
+
+        if reason is not None:
+            print(f"note: {reason}; every package is affected")
+            affected = set(ref_packages)
+
+        print(
+            f"note: {len(changes.changed_paths())} files changed since "
+            f"{settings.changed_since}, affecting "
+            f"{len(affected & set(ref_packages))} packages"
+        )
+
     # Sampling setup.
 
-    if settings.sample_percentage is None:
+    if affected is not None:
+        print("note: testing affected packages, and any without recorded inputs")
+    elif settings.sample_percentage is None:
         TARGET_N_PACKAGES = 100
         settings.sample_percentage = max(
             100 * TARGET_N_PACKAGES // len(ref_packages), 1
@@ -146,19 +308,29 @@ def entrypoint(argv):
             f"note: sampling {settings.sample_percentage}% of the randomized test cases"
         )
 
-    print(
-        f"note: sample key is {settings.sample_key}; use argument `-K {settings.sample_key}` to reproduce this run`"
-    )
+    if affected is None:
+        print(
+            f"note: sample key is {settings.sample_key}; use argument `-K {settings.sample_key}` to reproduce this run`"
+        )
 
-    # Run the tests
+    # Select the packages to test
 
     refkeys = sorted(ref_packages.keys())
+    to_test = []
 
     for pkg in refkeys:
         info = ref_packages[pkg]
         tags = info["tags"]
 
         if info.get("just_added", False):
+            random_skipped = False
+        elif affected is not None:
+            # Change-impact mode: only skip packages that we know don't
+            # depend on anything that changed.
+            if deps.has(pkg) and pkg not in affected:
+                n_unaffected += 1
+                continue
+
             random_skipped = False
         elif "randkey" in info:
             effkey = (info["randkey"] + settings.sample_key) % 100
@@ -170,40 +342,251 @@ def entrypoint(argv):
             n_skipped += 1
             continue
 
-        print(pkg, "... ", end="")
-        sys.stdout.flush()
-        n_tested += 1
+        to_test.append(pkg)
+
+    # Plan the order of the compiles. Packages that are new or that
+    # regressed last time go first, so that problems show up early. Within
+    # that, packages whose inputs we don't know yet go first, so that a
+    # partial run learns the most, and then the longest ones, so that the
+    # jobs finish at about the same time. Packages we haven't timed are
+    # assumed to be typical.
+
+    history = PackageHistory(bundle.test_path("packages-history.json"))
+    timed = sorted(d for d in map(history.duration, to_test) if d is not None)
+    typical = timed[len(timed) // 2] if timed else 1.0
+
+    def expected_duration(pkg):
+        duration = history.duration(pkg)
+        return typical if duration is None else duration
+
+    def is_urgent(pkg):
+        info = ref_packages[pkg]
+
+        if info.get("just_added", False):
+            return True
+
+        return history.outcome(pkg) in ("fail", "hang") and "xfail" not in info["tags"]
+
+    schedule = sorted(
+        to_test,
+        key=lambda pkg: (not is_urgent(pkg), deps.has(pkg), -expected_duration(pkg)),
+    )
+    n_urgent = sum(1 for pkg in schedule if is_urgent(pkg))
+
+    if timed:
+        work = sum(map(expected_duration, schedule))
+        print(
+            f"note: about {work:.0f}s of compiles expected from past runs, "
+            f"or {work / settings.jobs:.0f}s with {settings.jobs} jobs"
+        )
+
+    if n_urgent:
+        print(f"note: starting with {n_urgent} new or recently failing packages")
+
+    # Group the packages into units of work. Packages that are expected to
+    # fail are always compiled on their own, since they would just make their
+    # batch fail, and so are new packages, whose first tags should come from
+    # a compile of their own. Everything else is grouped into batches of
+    # consecutive packages, which are bisected if they fail.
+
+    units = []
+    batch = []
+
+    for pkg in schedule:
+        info = ref_packages[pkg]
+
+        if (
+            settings.batch_size < 2
+            or "xfail" in info["tags"]
+            or info.get("just_added", False)
+        ):
+            units.append([pkg])
+            continue
+
+        batch.append(pkg)
 
+        if len(batch) == settings.batch_size:
+            units.append(batch)
+            batch = []
+
+    if batch:
+        units.append(batch)
+
+    # Run the tests. Each worker thread just babysits one `tectonic` process
+    # at a time, so the thread pool is effectively a bounded process pool.
+    # Results are reported in sorted order regardless of which compile
+    # finishes first, so that the output of different runs can be compared
+    # directly.
+
+    if settings.jobs > 1:
+        print(f"note: running up to {settings.jobs} compiles in parallel")
+
+    if settings.batch_size > 1:
+        print(f"note: testing packages in batches of up to {settings.batch_size}")
+
+    reportpath = bundle.test_path("packages-report.jsonl")
+    report = measure.Report(reportpath)
+
+    # Make sure that the LaTeX format is built before we start, so that it
+    # isn't built by every worker or counted in the time of the first tests.
+
+    cache_root = settings.cache_dir or bundle.test_path("cache")
+
+    try:
+        env, format_record = formatcache.prepare(
+            TECTONIC_PROGRAM,
+            bundle.zip_path(),
+            cache_root,
+            timeout=settings.timeout,
+            report=report,
+        )
+        program_identity = formatcache.program_identity(TECTONIC_PROGRAM)
+    except (OSError, RuntimeError) as e:
+        die(str(e))
+
+    if format_record is None:
+        print(f"note: reusing the warm format cache under {cache_root}")
+    else:
+        print(f"note: built the LaTeX format in {format_record['wall']:.1f}s")
+
+    cache = ResultCache(
+        bundle.test_path("packages-cache.json"),
+        formatcache.bundle_digest(bundle.zip_path()),
+        program_identity,
+    )
+    batchdir = bundle.test_path("batches")
+    launches = []
+
+    def run_one(pkg):
+        document = make_document(pkg)
+        launches.append(pkg)
         thisdir = os.path.join(packagedir, pkg)
-        os.makedirs(thisdir, exist_ok=True)
+        timeout = history.timeout(pkg, settings)
+        record = compile_package(bundle, packagedir, pkg, document, timeout, env)
+        report.add(pkg, record, kind="package", timeout=timeout)
+        result = record["status"]
+        history.record(pkg, result, record["wall"])
+
+        # Timeouts aren't cached since they're more likely to be due to a
+        # loaded machine than to the package itself. Their logs are
+        # incomplete, so we don't record their inputs either.
+        if result is not None:
+            logpath = os.path.abspath(os.path.join(thisdir, "log.txt"))
+            inputs = read_inputs(thisdir, ttb)
+            cache.store(cache.key(pkg, document), pkg, result, logpath, inputs)
+            deps.record(pkg, inputs)
+
+        return result
+
+    def run_group(group):
+        """
+        Test a group of packages, returning a dict mapping each package to
+        its result. If the group can't all be loaded in one document, it is
+        split in half and each half is tested separately, until the failures
+        are isolated into single-package compiles.
+        """
+        if len(group) == 1:
+            return {group[0]: run_one(group[0])}
+
+        thisdir = os.path.join(batchdir, f"{group[0]}+{len(group) - 1}")
+        launches.append(thisdir)
+        timeout = min(
+            settings.timeout, sum(history.timeout(pkg, settings) for pkg in group)
+        )
+        record = compile_document(
+            bundle, thisdir, make_batch_document(group), timeout, env
+        )
+        report.add(
+            os.path.basename(thisdir),
+            record,
+            kind="batch",
+            packages=group,
+            timeout=timeout,
+        )
+
+        if record["status"] == 0:
+            # We record the batch's result for each package. This is almost
+            # always right, but a package that needs another one loaded first
+            # can pass here and fail alone; see the module docs.
+            logpath = os.path.abspath(os.path.join(thisdir, "log.txt"))
+            inputs = read_inputs(thisdir, ttb)
+
+            for pkg in group:
+                cache.store(
+                    cache.key(pkg, make_document(pkg)),
+                    pkg,
+                    0,
+                    logpath,
+                    inputs,
+                    batch=True,
+                )
+                deps.record(pkg, inputs)
+                history.record(pkg, 0, record["wall"] / len(group))
+
+            return dict((pkg, 0) for pkg in group)
+
+        mid = len(group) // 2
+        results = run_group(group[:mid])
+        results.update(run_group(group[mid:]))
+        return results
+
+    def run_unit(unit):
+        """
+        Test a unit of work, returning a dict mapping each package to a tuple
+        of `(result, cached)`. Cached results are used where possible.
+        """
+        results = {}
+        pending = []
+
+        # A package in a unit of its own will be compiled alone, so it can't
+        # use a result that it only got in a batch.
+        solo = len(unit) == 1
+
+        for pkg in unit:
+            entry = None
 
-        texpath = os.path.join(thisdir, "index.tex")
+            if not settings.no_cache:
+                entry = cache.lookup(cache.key(pkg, make_document(pkg)), solo=solo)
 
-        params = {
-            "class": "article",
-            "package": pkg,
-        }
+            if entry is None:
+                pending.append(pkg)
+                continue
 
-        with open(texpath, "wt") as f:
-            print(DOC_CLASS_TEMPLATE % params, file=f)
-            print(PACKAGE_TEMPLATE % params, file=f)
-            print(DOCUMENT_BODY, file=f)
+            results[pkg] = (entry["result"], True)
 
-        with open(os.path.join(thisdir, "log.txt"), "wb") as log:
-            result = subprocess.call(
-                [TECTONIC_PROGRAM, "-p", "-b", bundle.zip_path(), texpath],
-                shell=False,
-                stdout=log,
-                stderr=subprocess.STDOUT,
-            )
+            # The cache key includes the bundle hash, so the cached inputs
+            # can be resolved against this bundle.
+            if ttb is not None and entry.get("inputs") is not None:
+                infos = [ttb.files[p] for p in entry["inputs"] if p in ttb.files]
+                deps.record(pkg, infos)
+
+        if pending:
+            for pkg, result in run_group(pending).items():
+                results[pkg] = (result, False)
+
+        return results
+
+    def report_pkg(pkg, outcome):
+        nonlocal n_tested, n_cached, n_surprises, n_xfail, n_errors, n_hangs
+        result, cached = outcome
+        tags = ref_packages[pkg]["tags"]
+        n_tested += 1
+
+        if result is None:
+            suffix = " (timeout)"
+        elif cached:
+            suffix = " (cached)"
+            n_cached += 1
+        else:
+            suffix = ""
 
         if result == 0:
             if "ok" in tags:
-                print("pass", flush=True)
+                verdict = "pass"
             else:
                 # This test succeeded even though we didn't expect it to.
                 # Not a bad thing, but worth noting!
-                print("pass (unexpected)", flush=True)
+                verdict = "pass (unexpected)"
                 n_surprises += 1
 
             try:
@@ -212,28 +595,73 @@ def entrypoint(argv):
                 pass
 
             tags.add("ok")
+        elif "xfail" in tags:
+            verdict = "xfail"
+            n_xfail += 1
+        elif result is None:
+            # The compile was killed for running too long. That may be down
+            # to a loaded machine rather than the package, so we don't draw
+            # any conclusions about it in update mode.
+            verdict = "HANG"
+            suffix = ""
+            n_hangs += 1
+            n_errors += 1
         else:
-            if "xfail" in tags:
-                print("xfail", flush=True)
-                n_xfail += 1
-            else:
-                # This test failed unexpectedly :-(
-                print("FAIL", flush=True)
-                n_errors += 1
+            # This test failed unexpectedly :-(
+            verdict = "FAIL"
+            n_errors += 1
+
+        if result != 0 and verdict != "HANG" and settings.update:
+            try:
+                tags.remove("ok")
+            except KeyError:
+                pass
+
+            tags.add("xfail")
+
+        print(f"{pkg} ... {verdict}{suffix}", flush=True)
 
-            if settings.update:
-                try:
-                    tags.remove("ok")
-                except KeyError:
-                    pass
+        if verdict != "pass":
+            notable[pkg] = verdict + suffix
 
-                tags.add("xfail")
+    # Units run in schedule order, and each one's results are reported as
+    # soon as it finishes, so that early failures are seen early.
+
+    notable = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=settings.jobs) as pool:
+        futures = [pool.submit(run_unit, unit) for unit in units]
+
+        for future in concurrent.futures.as_completed(futures):
+            for pkg, outcome in sorted(future.result().items()):
+                report_pkg(pkg, outcome)
+
+    cache.save()
+    deps.save()
+    history.save()
+    report.close()
+
+    if ttb is not None:
+        ttb.close()
+
+    if notable:
+        print()
+        print("Outcomes other than expected passes, in sorted order:")
+
+        for pkg in sorted(notable):
+            print(f"  {pkg} ... {notable[pkg]}")
 
     print()
     print("Summary:")
     print(f"- Tested {n_tested} packages")
+    if n_cached:
+        print(f"- {n_cached} results reused from the cache")
+    if settings.batch_size > 1:
+        print(f"- {len(launches)} engine launches")
     if n_skipped:
         print(f"- {n_skipped} cases skipped")
+    if n_unaffected:
+        print(f"- {n_unaffected} packages unaffected by bundle changes")
     if n_missing:
         print(f"- {n_missing} packages missing from packages.txt")
     if n_removed:
@@ -242,12 +670,20 @@ def entrypoint(argv):
         print(f"- {n_xfail} expected failures")
     if n_surprises:
         print(f"- {n_surprises} surprise passes")
+    if n_hangs:
+        print(f"- {n_hangs} packages hung and were killed (counted as errors)")
     if n_errors:
         print(
             f"- {n_errors} total errors: test failed (outputs stored in {packagedir})"
         )
     else:
         print(f"- no errors: test passed (outputs stored in {packagedir})")
+    if format_record is not None:
+        print(
+            f"- building the format took {format_record['wall']:.1f}s "
+            "(not included in package timings)"
+        )
+    print(f"- timings and resource usage saved to {reportpath}")
 
     # Update listing if needed
 
@@ -270,6 +706,410 @@ def entrypoint(argv):
     return 1 if n_errors and not settings.update else 0
 
 
+def make_document(pkg):
+    params = {
+        "class": "article",
+        "package": pkg,
+    }
+
+    return "\n".join(
+        [DOC_CLASS_TEMPLATE % params, PACKAGE_TEMPLATE % params, DOCUMENT_BODY, ""]
+    )
+
+
+def make_batch_document(pkgs):
+    lines = [DOC_CLASS_TEMPLATE % {"class": "article"}]
+
+    for pkg in pkgs:
+        lines.append(PACKAGE_TEMPLATE % {"package": pkg})
+
+    lines += [DOCUMENT_BODY, ""]
+    return "\n".join(lines)
+
+
+def compile_package(bundle, packagedir, pkg, document, timeout, env):
+    """
+    Compile *document*, the test document for *pkg*, in a per-package
+    directory under *packagedir*.
+    """
+    return compile_document(
+        bundle, os.path.join(packagedir, pkg), document, timeout, env
+    )
+
+
+def compile_document(bundle, thisdir, document, timeout, env):
+    """
+    Compile *document*, storing it and the log in *thisdir*, in the
+    environment *env*. Returns a measurement record as produced by
+    `measure.run_measured()`; its `status` is the exit code of the compile,
+    or None if it was killed after running for more than *timeout* seconds.
+    """
+    os.makedirs(thisdir, exist_ok=True)
+
+    texpath = os.path.join(thisdir, "index.tex")
+
+    with open(texpath, "wt") as f:
+        f.write(document)
+
+    # We keep the TeX log to find out which bundle files were opened.
+    return measure.run_measured(
+        [TECTONIC_PROGRAM, "-p", "--keep-logs", "-b", bundle.zip_path(), texpath],
+        os.path.join(thisdir, "log.txt"),
+        timeout=timeout,
+        env=env,
+    )
+
+
+def unwrap_log(text):
+    """
+    Undo TeX's line breaking of *text*, so that file names that were split
+    across lines can be found.
+    """
+    lines = []
+    current = ""
+
+    for line in text.split("\n"):
+        current += line
+
+        if len(line) != MAX_PRINT_LINE:
+            lines.append(current)
+            current = ""
+
+    lines.append(current)
+    return "\n".join(lines)
+
+
+def read_inputs(thisdir, ttb):
+    """
+    Get the bundle files opened by the compile in *thisdir*, as a list of
+    FileInfo records from the bundle *ttb*, or None if there's no TeX log or
+    no bundle index. Names are resolved the same way the engine does, so
+    names that don't resolve, like filesystem paths and stray parentheses in
+    the log, are ignored.
+    """
+    if ttb is None:
+        return None
+
+    try:
+        with open(
+            os.path.join(thisdir, "index.log"), encoding="utf8", errors="replace"
+        ) as f:
+            text = unwrap_log(f.read())
+    except FileNotFoundError:
+        return None
+
+    inputs = {}
+
+    for name in LOG_OPEN_RE.findall(text):
+        info = ttb.search(name)
+
+        if info is not None:
+            inputs[info.path] = info
+
+    return sorted(inputs.values(), key=lambda info: info.path)
+
+
+def is_format_source(path):
+    name = ttbv1.file_name(path)
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in FORMAT_SOURCES)
+
+
+class DependencyIndex:
+    """
+    A persistent record of the bundle files used by each package.
+
+    This is stored as a reverse index mapping each bundle path, then each
+    content hash, to the list of packages whose test compile opened that
+    version of that file. Entries may be recorded from worker threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.index = {}
+        self.inputs = {}
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            print(f"warning: ignoring corrupt dependency index {path}")
+            return
+
+        for pkg in data.get("packages", []):
+            self.inputs[pkg] = set()
+
+        for filepath, by_hash in data.get("index", {}).items():
+            for hash, pkgs in by_hash.items():
+                self.index.setdefault(filepath, {})[hash] = set(pkgs)
+
+                for pkg in pkgs:
+                    self.inputs.setdefault(pkg, set()).add((filepath, hash))
+
+    def has(self, pkg):
+        return pkg in self.inputs
+
+    def record(self, pkg, infos):
+        """
+        Record that *pkg* used the files *infos*, replacing anything recorded
+        before. If *infos* is None, nothing is known and nothing changes.
+        """
+        if infos is None:
+            return
+
+        with self.lock:
+            for filepath, hash in self.inputs.get(pkg, ()):
+                pkgs = self.index[filepath][hash]
+                pkgs.discard(pkg)
+
+                if not pkgs:
+                    del self.index[filepath][hash]
+
+                    if not self.index[filepath]:
+                        del self.index[filepath]
+
+            self.inputs[pkg] = set()
+
+            for info in infos:
+                hash = info.hash or "nohash"
+                self.index.setdefault(info.path, {}).setdefault(hash, set()).add(pkg)
+                self.inputs[pkg].add((info.path, hash))
+
+    def affected(self, changes, new):
+        """
+        Find the packages affected by going from one bundle to the bundle
+        *new*, given *changes*, their `diff.BundleDiff`.
+
+        Returns a tuple of `(packages, reason)`. If *reason* isn't None, it
+        describes a change that might affect every package.
+        """
+        if changes.search_changes:
+            return set(), "the bundle search order changed"
+
+        changed = changes.changed_paths()
+
+        for path in sorted(changed):
+            if is_format_source(path):
+                return set(), f"{path}, a likely LaTeX format source, changed"
+
+        # New files may shadow ones that packages used to get, so a package
+        # is also affected if it used a file with the same name.
+        new_names = set(ttbv1.file_name(p) for p in changes.added)
+        new_names.update(ttbv1.file_name(dest) for _, dest in changes.moved)
+        affected = set()
+
+        for filepath, by_hash in self.index.items():
+            if filepath in changed or ttbv1.file_name(filepath) in new_names:
+                for pkgs in by_hash.values():
+                    affected.update(pkgs)
+                continue
+
+            # Inputs recorded against some other bundle might not match
+            # either of the ones being compared.
+            info = new.files.get(filepath)
+            current = None if info is None else info.hash or "nohash"
+
+            for hash, pkgs in by_hash.items():
+                if hash != current:
+                    affected.update(pkgs)
+
+        return affected, None
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temppath = self.path + ".tmp"
+
+        with self.lock:
+            data = {
+                "packages": sorted(self.inputs),
+                "index": dict(
+                    (
+                        filepath,
+                        dict((hash, sorted(pkgs)) for hash, pkgs in by_hash.items()),
+                    )
+                    for filepath, by_hash in self.index.items()
+                ),
+            }
+
+            with open(temppath, "wt") as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+
+        os.replace(temppath, self.path)
+
+
+class PackageHistory:
+    """
+    A persistent record of how the latest compile of each package went: its
+    outcome, one of `pass`, `fail` or `hang`, and how long it took.
+
+    Packages that passed together in a batch are each recorded as taking an
+    equal share of the batch's time. Entries may be recorded from worker
+    threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except ValueError:
+            print(f"warning: ignoring corrupt package history {path}")
+            self.entries = {}
+
+    def outcome(self, pkg):
+        with self.lock:
+            return self.entries.get(pkg, {}).get("outcome")
+
+    def duration(self, pkg):
+        with self.lock:
+            return self.entries.get(pkg, {}).get("duration")
+
+    def record(self, pkg, result, duration):
+        """
+        Record the result of compiling *pkg*: its exit code, or None if it
+        was killed for running too long. The duration of a hang only tells us
+        how long we waited, so the previous duration is kept.
+        """
+        with self.lock:
+            entry = self.entries.setdefault(pkg, {})
+
+            if result is None:
+                entry["outcome"] = "hang"
+            else:
+                entry["outcome"] = "pass" if result == 0 else "fail"
+                entry["duration"] = round(duration, 3)
+
+    def timeout(self, pkg, settings):
+        """
+        Get the timeout for compiling *pkg*. If it passed last time, this is
+        `--timeout-factor` times as long as it took then, but at least
+        `MIN_TIMEOUT`. It is never more than `--timeout`, which is also used
+        for packages that didn't pass last time.
+        """
+        duration = self.duration(pkg)
+
+        if (
+            not settings.timeout_factor
+            or duration is None
+            or self.outcome(pkg) != "pass"
+        ):
+            return settings.timeout
+
+        adaptive = max(MIN_TIMEOUT, settings.timeout_factor * duration)
+        return min(settings.timeout, adaptive)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temppath = self.path + ".tmp"
+
+        with self.lock:
+            with open(temppath, "wt") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+
+        os.replace(temppath, self.path)
+
+
+class ResultCache:
+    """
+    A persistent record of test outcomes.
+
+    Results are keyed on everything that can affect them: the bundle hash,
+    the identity of the `tectonic` binary, the package name, and the full
+    text of the test document. Passes from a batch are stored under the key
+    of the package's own document, but are marked as such, since the package
+    wasn't compiled alone. The cache is only read and written by the main
+    thread, but entries may be looked up and stored from worker threads.
+    """
+
+    def __init__(self, path, bundle_digest, program_identity):
+        self.path = path
+        self.logdir = os.path.splitext(os.path.abspath(path))[0] + "-logs"
+        self.bundle_digest = bundle_digest
+        self.program_identity = program_identity
+        self.lock = threading.Lock()
+
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except ValueError:
+            print(f"warning: ignoring corrupt result cache {path}")
+            self.entries = {}
+
+    def key(self, pkg, document):
+        h = hashlib.sha256()
+
+        for item in (self.bundle_digest, self.program_identity, pkg, document):
+            h.update(item.encode("utf8"))
+            h.update(b"\0")
+
+        return h.hexdigest()
+
+    def lookup(self, key, solo=False):
+        """
+        Get the cache entry for *key*, or None if there isn't a usable cached
+        result. The entry is a dict with the exit code as `result`, and the
+        bundle paths of the compile's inputs as `inputs`, or None if they
+        weren't recorded. An entry is only usable if its own copy of the log
+        is still around, and, if *solo* is true, if it didn't come from a
+        batch.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is None or entry["log"] != self.log_path(key):
+            return None
+
+        if solo and entry.get("batch", False):
+            return None
+
+        if not os.path.exists(entry["log"]):
+            return None
+
+        return entry
+
+    def log_path(self, key):
+        return os.path.join(self.logdir, key + ".txt")
+
+    def store(self, key, pkg, result, logpath, inputs=None, batch=False):
+        """
+        Store the result of a compile, with a copy of its log at *logpath*,
+        and its *inputs* as returned by `read_inputs()`. Set *batch* if *pkg*
+        was compiled in a batch rather than on its own. The log is copied
+        because the compile's directory is shared by runs with other bundles
+        and binaries.
+        """
+        cached_log = self.log_path(key)
+        os.makedirs(self.logdir, exist_ok=True)
+        shutil.copyfile(logpath, cached_log)
+
+        with self.lock:
+            self.entries[key] = {
+                "package": pkg,
+                "result": result,
+                "log": cached_log,
+                "inputs": None if inputs is None else [i.path for i in inputs],
+                "batch": batch,
+            }
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temppath = self.path + ".tmp"
+
+        with self.lock:
+            with open(temppath, "wt") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+
+        os.replace(temppath, self.path)
+
+
 def make_arg_parser():
     p = argparse.ArgumentParser()
     p.add_argument(
@@ -291,6 +1131,52 @@ def make_arg_parser():
         type=int,
         help='The "key" determining which random subset of cases are sampled',
     )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=verify.positive_int,
+        default=1,
+        help="The number of packages to compile in parallel",
+    )
+    p.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=float,
+        default=300,
+        help="Kill any compile that runs longer than this many seconds",
+    )
+    p.add_argument(
+        "--timeout-factor",
+        dest="timeout_factor",
+        type=float,
+        default=5,
+        help="Kill any compile that runs this many times longer than last time (0 to disable)",
+    )
+    p.add_argument(
+        "-B",
+        "--batch",
+        dest="batch_size",
+        type=int,
+        default=1,
+        help="Load up to this many packages per compile, bisecting failed batches. "
+        "A package that needs another loaded first may pass in a batch, and "
+        "packages that pass in a batch only get output under `batches/`",
+    )
+    p.add_argument(
+        "--cache-dir",
+        help="Where to keep the warm Tectonic cache (default: in the test output directory)",
+    )
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Recompile every sampled package even if a cached result is available",
+    )
+    p.add_argument(
+        "--changed-since",
+        metavar="OLD_TTB",
+        help="Instead of sampling, test the packages affected by changes since this older bundle",
+    )
     p.add_argument(
         "bundle_dir",
         help="The directory of the bundle specification",
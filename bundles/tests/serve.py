@@ -0,0 +1,509 @@
+#! /usr/bin/env python3
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2024 the Tectonic Project.
+# Licensed under the MIT License.
+
+"""
+Serve a bundle over HTTP, the way Tectonic expects to fetch network bundles.
+
+Tectonic reads a remote TTBv1 bundle with HTTP range requests: first the
+header, then the gzipped index, then one range per file that it opens. This
+server lets us see and shape that traffic on a machine with no network:
+
+    ./serve.py --port 8080 --log requests.jsonl texlive2023.ttb &
+    tectonic -b http://127.0.0.1:8080/texlive2023.ttb files/amsmath.tex
+
+The bundle is memory-mapped and served at `/<file name>`. `HEAD` and plain
+`GET` requests are supported, as are `Range` requests for one or more byte
+ranges; multiple ranges get a `multipart/byteranges` response. As RFC 9110
+requires, a malformed `Range` header is ignored and answered with the whole
+bundle, and only well-formed ranges that can't be satisfied get a 416. Data
+are sent with `sendfile()` where the platform supports it, unless a bandwidth
+cap is in effect, and are otherwise written out from the mapping, in paced
+chunks if there's a cap.
+
+To simulate a slow or unreliable server, use `--latency` to delay every
+response, `--bandwidth` to cap the total transfer rate across all
+connections, and `--error-rate` to fail a fraction of requests.
+
+Every request is logged to standard error and, with `--log`, to a JSONL file
+listing the requested ranges and the number of bytes sent. If the bundle is a
+TTBv1 bundle, ranges are labeled with the bundle files that they cover. A
+summary of requests and bytes is printed when the server is stopped.
+Compiling with an empty and then a warm `$TECTONIC_CACHE_DIR` shows how much
+of that traffic Tectonic's cache saves.
+"""
+
+import argparse
+import bisect
+import http.server
+import mmap
+import os.path
+import random
+import re
+import signal
+import sys
+import threading
+import time
+
+import measure
+import ttbv1
+import verify
+
+RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+BOUNDARY = "TTB_BYTERANGES_BOUNDARY"
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeError(Exception):
+    pass
+
+
+def parse_range_header(value, size):
+    """
+    Parse an HTTP `Range` header for a resource of *size* bytes, returning a
+    list of `(start, length)` tuples for the satisfiable ranges. Raises
+    RangeError if the header is malformed.
+    """
+    unit, _, spec = value.partition("=")
+
+    if unit.strip() != "bytes":
+        raise RangeError(f"unsupported range unit {unit!r}")
+
+    ranges = []
+
+    for item in spec.split(","):
+        m = RANGE_RE.match(item)
+
+        if m is None:
+            raise RangeError(f"malformed range {item!r}")
+
+        first, last = m.groups()
+
+        if first:
+            start = int(first)
+
+            if last and int(last) < start:
+                raise RangeError(f"malformed range {item!r}")
+
+            end = int(last) if last else size - 1
+        elif last:
+            # A suffix range: the last N bytes.
+            start = max(size - int(last), 0)
+            end = size - 1
+        else:
+            raise RangeError(f"malformed range {item!r}")
+
+        if start < size:
+            ranges.append((start, min(end, size - 1) - start + 1))
+
+    return ranges
+
+
+class Pacer:
+    """
+    Limit the total rate at which bytes are sent from any number of threads.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self, n_bytes):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + n_bytes / self.rate
+
+        if start > now:
+            time.sleep(start - now)
+
+
+class BundleServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, settings):
+        super().__init__(address, BundleRequestHandler)
+        self.settings = settings
+        self.name = os.path.basename(settings.bundle)
+        self.file = open(settings.bundle, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.map)
+        self.pacer = Pacer(settings.bandwidth) if settings.bandwidth else None
+        self.random = random.Random(settings.seed)
+        self.report = measure.Report(settings.log, append=True) if settings.log else None
+        self.lock = threading.Lock()
+        self.n_requests = 0
+        self.n_errors = 0
+        self.n_bytes = 0
+
+        # If this is a TTBv1 bundle, keep its index around so that we can say
+        # which files each request was for.
+        self.starts = []
+        self.entries = []
+
+        try:
+            with ttbv1.TTBv1Bundle(settings.bundle) as bundle:
+                self.entries = sorted(bundle, key=lambda i: i.start)
+                self.starts = [i.start for i in self.entries]
+                self.index_range = (bundle.index_start, bundle.index_gzip_len)
+        except ttbv1.BundleError:
+            self.index_range = None
+
+    def describe(self, start, length):
+        """
+        Get a list of names for what the byte range covers: `(header)`,
+        `(index)`, or bundle file paths.
+        """
+        end = start + length
+        names = []
+
+        if start < ttbv1.HEADER_SIZE:
+            names.append("(header)")
+
+        if self.index_range is not None:
+            istart, ilen = self.index_range
+
+            if start < istart + ilen and end > istart:
+                names.append("(index)")
+
+        i = max(bisect.bisect_right(self.starts, start) - 1, 0)
+
+        while i < len(self.entries) and self.entries[i].start < end:
+            info = self.entries[i]
+
+            if info.start + info.gzip_len > start:
+                names.append(info.path)
+
+            i += 1
+
+        return names
+
+    def log_request_record(self, record):
+        with self.lock:
+            self.n_requests += 1
+            self.n_bytes += record["bytes"]
+
+            if record["status"] >= 400:
+                self.n_errors += 1
+
+            n = self.n_requests
+
+        if not self.settings.quiet:
+            ranges = " ".join(f"{s}+{n}" for s, n in record["ranges"]) or "-"
+            files = ", ".join(record.get("files", [])[:3])
+
+            if len(record.get("files", [])) > 3:
+                files += f", ... ({len(record['files'])} files)"
+
+            print(
+                f"{record['method']} {record['status']} {ranges} "
+                f"{record['bytes']}B {record['time'] * 1000:.1f}ms {files}",
+                file=sys.stderr,
+                flush=True,
+            )
+
+        if self.report is not None:
+            self.report.add(str(n), record)
+
+    def server_close(self):
+        super().server_close()
+        self.map.close()
+        self.file.close()
+
+        if self.report is not None:
+            self.report.close()
+
+
+class BundleRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.handle_bundle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_bundle_request(send_body=True)
+
+    def log_message(self, format, *args):
+        # We do our own logging in `handle_bundle_request()`.
+        pass
+
+    def handle_bundle_request(self, send_body):
+        server = self.server
+        settings = server.settings
+        t0 = time.monotonic()
+        self.n_sent = 0
+        ranges = []
+        status = None
+
+        if settings.latency:
+            time.sleep(settings.latency)
+
+        with server.lock:
+            fail = settings.error_rate and server.random.random() < settings.error_rate
+
+        try:
+            if self.path.split("?", 1)[0] != "/" + server.name:
+                status = 404
+                self.send_empty(404)
+            elif fail:
+                status = settings.error_status
+                self.send_empty(status)
+            else:
+                ranges = None
+
+                if "Range" in self.headers:
+                    try:
+                        ranges = parse_range_header(self.headers["Range"], server.size)
+                    except RangeError:
+                        # An invalid Range header is ignored (RFC 9110
+                        # section 14.2).
+                        pass
+
+                if ranges is None:
+                    status = 200
+                    ranges = [(0, server.size)]
+                    self.send_response(200)
+                    self.send_header("Accept-Ranges", "bytes")
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(server.size))
+                    self.end_headers()
+
+                    if send_body:
+                        self.send_data(0, server.size)
+                elif not ranges:
+                    status = 416
+                    self.send_empty(416, {"Content-Range": f"bytes */{server.size}"})
+                elif len(ranges) == 1:
+                    status = 206
+                    self.send_single_range(ranges[0], send_body)
+                else:
+                    status = 206
+                    self.send_multiple_ranges(ranges, send_body)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+        record = {
+            "method": self.command,
+            "path": self.path,
+            "status": status,
+            "ranges": ranges,
+            "bytes": self.n_sent,
+            "time": round(time.monotonic() - t0, 6),
+        }
+
+        if server.index_range is not None and status == 206:
+            record["files"] = [
+                name for start, length in ranges for name in server.describe(start, length)
+            ]
+
+        server.log_request_record(record)
+
+    def send_empty(self, status, headers={}):
+        self.send_response(status)
+
+        for key, value in headers.items():
+            self.send_header(key, value)
+
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_single_range(self, range, send_body):
+        start, length = range
+        self.send_response(206)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header(
+            "Content-Range", f"bytes {start}-{start + length - 1}/{self.server.size}"
+        )
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+        if send_body:
+            self.send_data(start, length)
+
+    def send_multiple_ranges(self, ranges, send_body):
+        size = self.server.size
+        parts = []
+
+        for start, length in ranges:
+            head = (
+                f"\r\n--{BOUNDARY}\r\n"
+                "Content-Type: application/octet-stream\r\n"
+                f"Content-Range: bytes {start}-{start + length - 1}/{size}\r\n"
+                "\r\n"
+            ).encode("ascii")
+            parts.append((head, start, length))
+
+        tail = f"\r\n--{BOUNDARY}--\r\n".encode("ascii")
+        total = sum(len(head) + length for head, _, length in parts) + len(tail)
+
+        self.send_response(206)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", f"multipart/byteranges; boundary={BOUNDARY}")
+        self.send_header("Content-Length", str(total))
+        self.end_headers()
+
+        if not send_body:
+            return
+
+        for head, start, length in parts:
+            self.wfile.write(head)
+            self.send_data(start, length)
+
+        self.wfile.write(tail)
+
+    def send_data(self, start, length):
+        server = self.server
+        end = start + length
+        offset = start
+
+        if server.pacer is None and hasattr(os, "sendfile"):
+            # Have the kernel send straight from the page cache. We don't use
+            # `socket.sendfile()`, since its fallback seeks and reads the file
+            # object, whose position is shared by all of the handler threads;
+            # `os.sendfile()` takes the offset explicitly. Like the socket
+            # method, we give up and copy if the first call fails.
+            try:
+                while offset < end:
+                    n = os.sendfile(
+                        self.connection.fileno(),
+                        server.file.fileno(),
+                        offset,
+                        end - offset,
+                    )
+
+                    if n == 0:
+                        break
+
+                    self.n_sent += n
+                    offset += n
+
+                return
+            except OSError:
+                if offset != start:
+                    raise
+
+        if server.pacer is None:
+            with memoryview(server.map)[offset:end] as view:
+                self.wfile.write(view)
+
+            self.n_sent += end - offset
+            return
+
+        while offset < end:
+            n = min(CHUNK_SIZE, end - offset)
+            server.pacer.wait(n)
+            self.wfile.write(server.map[offset : offset + n])
+            self.n_sent += n
+            offset += n
+
+
+def entrypoint(argv):
+    settings = make_arg_parser().parse_args(argv[1:])
+
+    if not 0 <= settings.error_rate <= 1:
+        print("error: the error rate must be between 0 and 1", file=sys.stderr)
+        return 1
+
+    try:
+        server = BundleServer((settings.host, settings.port), settings)
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    host, port = server.server_address[:2]
+    print(f"note: serving {settings.bundle} at http://{host}:{port}/{server.name}", flush=True)
+
+    if server.index_range is None:
+        print("note: not a TTBv1 bundle; requests won't be labeled with file names")
+
+    # Stop cleanly, with a summary, when run in the background and killed.
+    def on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    t0 = time.monotonic()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    elapsed = time.monotonic() - t0
+    print()
+    print("Summary:")
+    print(f"- {server.n_requests} requests in {elapsed:.1f}s")
+    print(f"- {server.n_bytes} bytes sent")
+    if server.n_errors:
+        print(f"- {server.n_errors} error responses")
+    if settings.log:
+        print(f"- requests logged to {settings.log}")
+
+    return 0
+
+
+def make_arg_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="The address to listen on (default: %(default)s)",
+    )
+    p.add_argument(
+        "--port",
+        type=int,
+        default=0,
+        help="The port to listen on (default: pick a free one)",
+    )
+    p.add_argument(
+        "--latency",
+        type=verify.non_negative_float,
+        default=0,
+        help="Delay every response by this many seconds",
+    )
+    p.add_argument(
+        "--bandwidth",
+        type=verify.non_negative_float,
+        default=0,
+        help="Cap the total transfer rate at this many bytes per second (0 for no cap)",
+    )
+    p.add_argument(
+        "--error-rate",
+        type=float,
+        default=0,
+        help="Fail this fraction of requests (between 0 and 1)",
+    )
+    p.add_argument(
+        "--error-status",
+        type=int,
+        default=503,
+        help="The HTTP status of failed requests (default: %(default)s)",
+    )
+    p.add_argument(
+        "--seed",
+        type=int,
+        help="Random seed for choosing which requests fail",
+    )
+    p.add_argument(
+        "--log",
+        help="Append a JSONL record of every request to this file",
+    )
+    p.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Don't log each request to standard error",
+    )
+    p.add_argument(
+        "bundle",
+        help="The path to the `.ttb` bundle to serve",
+    )
+    return p
+
+
+if __name__ == "__main__":
+    sys.exit(entrypoint(sys.argv))
@@ -0,0 +1,387 @@
+#! /usr/bin/env python3
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2024 the Tectonic Project.
+# Licensed under the MIT License.
+
+"""
+Test a TTBv1 bundle by compiling the documents under `files/` and `formats/`
+and a minimal document for each document class in `classes.list`.
+
+Usage is the same as `test.sh`, which is now a wrapper around this script:
+
+    ./suite.py <path-to-ttb> <all|files|classes|class> [class] [flags]
+
+Each line of `classes.list` is `<class> <flags> [comment]`, where the flags
+are comma-separated. Classes flagged `xfail` are skipped, and classes flagged
+`titleauth` get a title and author in their test document.
+
+Compiles are run on a pool of `-j` workers. All output ends up under `build/`
+next to this script, as described in `README.md`. In addition to the log files
+and pass/fail lists, the outcome of every compile is saved to
+`build/results.json`, and its timing and resource usage to
+`build/report.jsonl`.
+
+Before any tests are run, the LaTeX format is built once into a Tectonic cache
+keyed on the bundle hash and the `tectonic` binary, which all of the test
+compiles then share (see `formatcache.py`). That cache lives in `cache/` next
+to this script, so it survives between runs; `--cache-dir` can point it
+elsewhere, for instance to share it with `packages.py`.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os.path
+import shutil
+import sys
+
+import formatcache
+import measure
+import verify
+
+TECTONIC_PROGRAM = os.environ.get("TECTONIC", "tectonic")
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CLASS_TEMPLATE = r"\documentclass{%(class)s}"
+
+TITLEAUTH_TEMPLATE = r"""\title{Test Title}
+\author{An Author}
+"""
+
+DOCUMENT_BODY = r"""\begin{document}
+Hello, world
+\end{document}"""
+
+GREEN = "\033[0;32m"
+RED = "\033[0;31m"
+NC = "\033[0m"
+
+
+class Case:
+    """
+    One test compile.
+
+    *group* is `files`, `formats` or `classes`; *name* identifies the case
+    within its group. The output of the compile goes to *outdir*.
+    """
+
+    def __init__(self, group, name, texpath, outdir, args=()):
+        self.group = group
+        self.name = name
+        self.texpath = texpath
+        self.outdir = outdir
+        self.args = list(args)
+        self.logpath = os.path.join(outdir, "logs", os.path.basename(texpath) + ".log")
+        self.record = None
+
+    @property
+    def id(self):
+        return f"{self.group}/{self.name}"
+
+    @property
+    def passed(self):
+        return self.record is not None and self.record["status"] == 0
+
+    def run(self, settings):
+        argv = [
+            TECTONIC_PROGRAM,
+            "--chatter",
+            "minimal",
+            "--outdir",
+            self.outdir,
+        ]
+        argv += self.args
+        argv += ["--bundle", settings.bundle, self.texpath]
+        self.record = measure.run_measured(
+            argv, self.logpath, timeout=settings.timeout, env=settings.env
+        )
+        return self
+
+
+def load_classes():
+    """
+    Load `classes.list` as a list of `(class, flags)` tuples, where *flags*
+    is a set.
+    """
+    classes = []
+
+    with open(os.path.join(TEST_DIR, "classes.list")) as f:
+        for line in f:
+            bits = line.split()
+
+            if not bits:
+                continue
+
+            flags = set(bits[1].split(",")) if len(bits) > 1 else set()
+            classes.append((bits[0], flags))
+
+    return classes
+
+
+def make_class_case(outdir, cls, flags):
+    params = {"class": cls}
+    lines = [CLASS_TEMPLATE % params, ""]
+
+    if "titleauth" in flags:
+        lines.append(TITLEAUTH_TEMPLATE)
+
+    lines += [DOCUMENT_BODY, ""]
+
+    # Each class gets its own input file so that compiles can run in
+    # parallel without stepping on each other.
+    texpath = os.path.join(outdir, "inputs", cls + ".tex")
+
+    with open(texpath, "wt") as f:
+        f.write("\n".join(lines))
+
+    return Case("classes", cls, texpath, outdir)
+
+
+def make_file_cases(outdir):
+    cases = []
+
+    for subdir, args in (("files", []), ("formats", ["-p", "--outfmt", "fmt"])):
+        srcdir = os.path.join(TEST_DIR, subdir)
+
+        for name in sorted(os.listdir(srcdir)):
+            cases.append(
+                Case(subdir, name, os.path.join(srcdir, name), outdir, args)
+            )
+
+    return cases
+
+
+def run_cases(cases, settings, report, on_done):
+    """
+    Run *cases* on a worker pool, calling *on_done* with each finished case
+    in the order that they're given.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=settings.jobs) as pool:
+        for case in pool.map(lambda c: c.run(settings), cases):
+            report.add(case.id, case.record)
+            on_done(case)
+
+
+def test_files(settings, report):
+    outdir = os.path.join(settings.output_dir, "files")
+    shutil.rmtree(outdir, ignore_errors=True)
+    os.makedirs(os.path.join(outdir, "logs"))
+
+    cases = make_file_cases(outdir)
+
+    def on_done(case):
+        status = f"{GREEN}PASS{NC}" if case.passed else f"{RED}FAIL{NC}"
+        print(f"{status} Tested {case.group[:-1]} {case.group}/{case.name}", flush=True)
+
+    run_cases(cases, settings, report, on_done)
+    return cases
+
+
+def test_classes(settings, report, only=None):
+    """
+    Test the classes in `classes.list`. If *only* is a `(class, flags)` tuple,
+    test just that class.
+    """
+    outdir = os.path.join(settings.output_dir, "classes")
+    shutil.rmtree(outdir, ignore_errors=True)
+
+    for subdir in ("inputs", "logs/passed", "logs/failed"):
+        os.makedirs(os.path.join(outdir, subdir))
+
+    if only is None:
+        classes = load_classes()
+    else:
+        classes = [only]
+
+    cases = []
+    n_skipped = 0
+
+    for cls, flags in classes:
+        if only is None and "xfail" in flags:
+            n_skipped += 1
+            continue
+
+        cases.append(make_class_case(outdir, cls, flags))
+
+    counts = {"passed": 0, "failed": 0}
+
+    def on_done(case):
+        key = "passed" if case.passed else "failed"
+        counts[key] += 1
+
+        # Sort the logs by outcome, like the shell version did.
+        dest = os.path.join(outdir, "logs", key, case.name + ".log")
+        os.replace(case.logpath, dest)
+        case.logpath = dest
+
+        print(
+            f"\r{counts['passed'] + counts['failed'] + n_skipped}/{len(classes)} "
+            f"{GREEN}P:{counts['passed']}{NC} "
+            f"{RED}F:{counts['failed']}{NC} "
+            f"S:{n_skipped} "
+            f"  Tested class {case.name}\033[K",
+            end="",
+            flush=True,
+        )
+
+    run_cases(cases, settings, report, on_done)
+    print()
+
+    for key in ("passed", "failed"):
+        with open(os.path.join(outdir, key), "wt") as f:
+            for case in cases:
+                if (key == "passed") == case.passed:
+                    print(case.name, file=f)
+
+    return cases, n_skipped
+
+
+def entrypoint(argv):
+    settings = make_arg_parser().parse_args(argv[1:])
+    settings.bundle = os.path.realpath(settings.bundle)
+    settings.output_dir = os.path.join(TEST_DIR, "build")
+
+    only = None
+
+    if settings.set == "class":
+        if settings.cls is None:
+            print("error: the `class` test set needs a class name", file=sys.stderr)
+            return 1
+
+        known = dict(load_classes())
+
+        if settings.cls not in known:
+            print(f"No such class {settings.cls}")
+            return 1
+
+        if settings.flags is None:
+            flags = known[settings.cls]
+        else:
+            flags = set(settings.flags.split(","))
+
+        only = (settings.cls, flags)
+
+    shutil.rmtree(settings.output_dir, ignore_errors=True)
+    os.makedirs(settings.output_dir)
+
+    cases = []
+    n_skipped = 0
+    cache_root = settings.cache_dir or os.path.join(TEST_DIR, "cache")
+
+    with measure.Report(os.path.join(settings.output_dir, "report.jsonl")) as report:
+        try:
+            settings.env, format_record = formatcache.prepare(
+                TECTONIC_PROGRAM,
+                settings.bundle,
+                cache_root,
+                timeout=settings.timeout,
+                report=report,
+            )
+        except (OSError, RuntimeError) as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 1
+
+        if format_record is None:
+            print(f"note: reusing the warm format cache under {cache_root}")
+        else:
+            print(f"note: built the LaTeX format in {format_record['wall']:.1f}s")
+
+        if settings.set in ("all", "files"):
+            cases += test_files(settings, report)
+
+        if settings.set in ("all", "classes", "class"):
+            class_cases, n_skipped = test_classes(settings, report, only)
+            cases += class_cases
+
+    n_passed = sum(1 for c in cases if c.passed)
+    n_timeouts = sum(1 for c in cases if c.record["status"] is None)
+    n_failed = len(cases) - n_passed
+
+    results = {
+        "bundle": settings.bundle,
+        "format": format_record,
+        "counts": {
+            "tested": len(cases),
+            "passed": n_passed,
+            "failed": n_failed,
+            "timeouts": n_timeouts,
+            "skipped": n_skipped,
+        },
+        "cases": [
+            dict(id=c.id, passed=c.passed, log=c.logpath, **c.record) for c in cases
+        ],
+    }
+
+    resultspath = os.path.join(settings.output_dir, "results.json")
+
+    with open(resultspath, "wt") as f:
+        json.dump(results, f, indent=1)
+
+    print()
+    print("Summary:")
+    print(f"- Tested {len(cases)} documents using {settings.jobs} workers")
+    print(f"- {n_passed} passed")
+    if n_skipped:
+        print(f"- {n_skipped} classes skipped")
+    if n_timeouts:
+        print(f"- {n_timeouts} timed out")
+    if format_record is not None:
+        print(
+            f"- building the format took {format_record['wall']:.1f}s "
+            "(not included in test timings)"
+        )
+    if n_failed:
+        print(f"- {n_failed} failed (results in {resultspath})")
+    else:
+        print(f"- no failures (results in {resultspath})")
+
+    return 1 if n_failed else 0
+
+
+def make_arg_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=verify.positive_int,
+        default=os.cpu_count() or 1,
+        help="The number of documents to compile in parallel (default: one per CPU)",
+    )
+    p.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=float,
+        default=300,
+        help="Kill and fail any compile that runs longer than this many seconds",
+    )
+    p.add_argument(
+        "--cache-dir",
+        help="Where to keep the warm Tectonic cache (default: `cache/` next to this script)",
+    )
+    p.add_argument(
+        "bundle",
+        help="The path to the `.ttb` bundle to test",
+    )
+    p.add_argument(
+        "set",
+        choices=["all", "files", "classes", "class"],
+        help="The set of tests to run",
+    )
+    p.add_argument(
+        "cls",
+        nargs="?",
+        metavar="class",
+        help="For the `class` set, the class to test",
+    )
+    p.add_argument(
+        "flags",
+        nargs="?",
+        help="For the `class` set, flags overriding those in classes.list",
+    )
+    return p
+
+
+if __name__ == "__main__":
+    sys.exit(entrypoint(sys.argv))
@@ -0,0 +1,141 @@
+#! /usr/bin/env python3
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2024 the Tectonic Project.
+# Licensed under the MIT License.
+
+"""
+Tests for the result cache of `packages.py`, run against a fake engine.
+
+The fake engine "builds" the LaTeX format by creating an empty format file in
+the cache directory, passes every compile, and records the document it was
+asked to compile, so that the tests can see which compiles were launched. The
+bundle is a zip bundle holding only a `SHA256SUM` file.
+
+Usage: python3 test_packages.py
+"""
+
+import contextlib
+import io
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import packages
+
+PACKAGES = ["alpha", "beta", "gamma"]
+DIGEST = "ab" * 32
+
+FAKE_ENGINE = """#! {python}
+import os, sys
+
+if "-p" not in sys.argv:
+    formats = os.path.join(os.environ["TECTONIC_CACHE_DIR"], "formats")
+    os.makedirs(formats, exist_ok=True)
+    open(os.path.join(formats, "{digest}-latex-33.fmt"), "w").close()
+
+with open({launches!r}, "a") as f:
+    print(sys.argv[-1], file=f)
+"""
+
+
+class FixtureBundle:
+    """
+    The parts of the bundle specification interface that `packages.py` uses,
+    backed by a temporary directory.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    @classmethod
+    def open_with_inferred_state(cls, bundle_dir):
+        return cls(bundle_dir)
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def listing_path(self):
+        return self.path("listing.txt")
+
+    def test_path(self, *parts):
+        return self.path("test", *parts)
+
+    def zip_path(self):
+        return self.path("bundle.zip")
+
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.bundle = FixtureBundle(self.root)
+        self.launches = os.path.join(self.root, "launches.txt")
+
+        with open(self.bundle.listing_path(), "wt") as f:
+            for pkg in PACKAGES:
+                print(f"{pkg}.sty", file=f)
+
+        with open(self.bundle.path("packages.txt"), "wt") as f:
+            for pkg in PACKAGES:
+                print(f"{pkg} ok rand=0", file=f)
+
+        with zipfile.ZipFile(self.bundle.zip_path(), "w") as z:
+            z.writestr("SHA256SUM", DIGEST + "\n")
+
+        engine = os.path.join(self.root, "tectonic")
+
+        with open(engine, "wt") as f:
+            f.write(
+                FAKE_ENGINE.format(
+                    python=sys.executable, digest=DIGEST, launches=self.launches
+                )
+            )
+
+        os.chmod(engine, 0o755)
+
+        self.saved = packages.Bundle, packages.TECTONIC_PROGRAM
+        packages.Bundle = FixtureBundle
+        packages.TECTONIC_PROGRAM = engine
+
+    def tearDown(self):
+        packages.Bundle, packages.TECTONIC_PROGRAM = self.saved
+        shutil.rmtree(self.root)
+
+    def run_packages(self, *args):
+        """
+        Run `packages.py` on all of the packages, returning the number of
+        engine launches, not counting the format build.
+        """
+        if os.path.exists(self.launches):
+            os.unlink(self.launches)
+
+        argv = ["packages.py", "-S", "100", "-K", "0", *args, self.root]
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(packages.entrypoint(argv), 0)
+
+        try:
+            with open(self.launches) as f:
+                return sum(1 for line in f if not line.strip().endswith("warmup.tex"))
+        except FileNotFoundError:
+            return 0
+
+    def test_batched_results_are_reused_by_batches(self):
+        self.assertEqual(self.run_packages("-B", "3"), 1)
+        self.assertEqual(self.run_packages("-B", "3"), 0)
+
+    def test_batched_results_are_not_reused_alone(self):
+        self.assertEqual(self.run_packages("-B", "3"), 1)
+        self.assertEqual(self.run_packages("-B", "1"), len(PACKAGES))
+        self.assertEqual(self.run_packages("-B", "1"), 0)
+
+    def test_solo_results_are_reused_by_batches(self):
+        self.assertEqual(self.run_packages("-B", "1"), len(PACKAGES))
+        self.assertEqual(self.run_packages("-B", "3"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
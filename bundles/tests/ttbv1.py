@@ -0,0 +1,392 @@
+#! /usr/bin/env python3
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2024 the Tectonic Project.
+# Licensed under the MIT License.
+
+"""
+Read files out of TTBv1 bundles without extracting them.
+
+The format is documented in `bundles/format-v1.md`. A bundle is memory-mapped,
+its header and index are parsed once when it is opened, and individual files
+are then decompressed straight out of the mapping. Bare file names can be
+resolved with the bundle's search order, following the same rules as the
+engine (see `crates/bundles/src/ttb.rs`).
+
+This can be used as a library:
+
+    with TTBv1Bundle("texlive2023.ttb") as bundle:
+        info = bundle.search("article.cls")
+        text = bundle.read(info.path)
+
+or from the command line; run with `--help` for details.
+"""
+
+import argparse
+import collections
+import mmap
+import sys
+import zlib
+
+HEADER_SIZE = 66
+SIGNATURE = b"tectonicbundle"
+
+# `wbits` value telling zlib to expect a gzip header and trailer.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class BundleError(Exception):
+    pass
+
+
+FileInfo = collections.namedtuple(
+    "FileInfo", ["start", "gzip_len", "real_len", "hash", "path"]
+)
+FileInfo.__doc__ = """\
+One `[FILELIST]` entry. `hash` is a hex SHA256 digest, or None for the special
+files that are stored with `nohash`.
+"""
+
+
+def file_name(path):
+    return path.rsplit("/", 1)[-1]
+
+
+def parse_header(header):
+    """
+    Parse a TTBv1 header, returning a tuple of `(index_start, index_gzip_len,
+    index_real_len, digest)`, where the digest is in hex.
+    """
+    if len(header) < HEADER_SIZE or header[:14] != SIGNATURE:
+        raise BundleError("this is not a bundle")
+
+    version = int.from_bytes(header[14:18], "little")
+    if version != 1:
+        raise BundleError(f"wrong ttb version {version}")
+
+    return (
+        int.from_bytes(header[18:26], "little"),
+        int.from_bytes(header[26:30], "little"),
+        int.from_bytes(header[30:34], "little"),
+        bytes(header[34:66]).hex(),
+    )
+
+
+def parse_index(text):
+    """
+    Parse the decompressed text of a bundle index. Returns a tuple of
+    `(files, search_orders, default_search)`, where *files* is a list of
+    FileInfo records in index order and *search_orders* maps search order
+    names to lists of rules.
+
+    Like the engine, we ignore lines outside of sections and unknown sections.
+    """
+    files = []
+    search_orders = {}
+    default_search = ""
+    mode = None
+    arg = None
+
+    for line in text.split("\n"):
+        if line.startswith("["):
+            mode, _, arg = line[1:-1].partition(":")
+            continue
+
+        if mode is None or not line:
+            continue
+
+        if mode == "DEFAULTSEARCH":
+            default_search = line
+        elif mode == "SEARCH":
+            search_orders.setdefault(arg, []).append(line)
+        elif mode == "FILELIST":
+            bits = line.split(" ", 4)
+
+            if len(bits) != 5:
+                raise BundleError(f"malformed FILELIST line {line!r}")
+
+            start, gzip_len, real_len, hash, path = bits
+
+            if path.startswith("/") or "./" in path or "//" in path:
+                raise BundleError(f"bad bundle file path {path!r}")
+
+            files.append(
+                FileInfo(
+                    int(start),
+                    int(gzip_len),
+                    int(real_len),
+                    None if hash == "nohash" else hash,
+                    path,
+                )
+            )
+
+    return files, search_orders, default_search
+
+
+def decompress(data, real_len):
+    """
+    Decompress one gzipped blob. *data* may be any buffer, such as a slice of
+    a memoryview; it is not copied. The output buffer is sized using
+    *real_len* up front so that it doesn't have to be grown as we go.
+    """
+    return zlib.decompress(data, GZIP_WBITS, max(real_len, 1))
+
+
+class TTBv1Bundle:
+    """
+    A memory-mapped TTBv1 bundle.
+
+    Attributes:
+
+    - `digest`: the bundle hash from the header, in hex
+    - `files`: a dict mapping paths to FileInfo records
+    - `search_orders`: a dict mapping search order names to lists of rules
+    - `default_search`: the name of the default search order
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped.
+                raise BundleError(f"{path}: this is not a bundle")
+
+        self.view = memoryview(self.map)
+
+        try:
+            (
+                self.index_start,
+                self.index_gzip_len,
+                self.index_real_len,
+                self.digest,
+            ) = parse_header(self.map[:HEADER_SIZE])
+
+            index_text = self.read_range(
+                self.index_start, self.index_gzip_len, self.index_real_len
+            ).decode("utf8")
+            entries, self.search_orders, self.default_search = parse_index(
+                index_text
+            )
+        except Exception:
+            self.close()
+            raise
+
+        self.files = {}
+        self.by_name = {}
+
+        for info in entries:
+            self.files[info.path] = info
+            self.by_name.setdefault(file_name(info.path), []).append(info)
+
+        self._search_cache = {}
+
+    def close(self):
+        if self.map is None:
+            return
+
+        self.view.release()
+        self.map.close()
+        self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __iter__(self):
+        return iter(self.files.values())
+
+    def raw(self, info):
+        """
+        Get the gzipped data for *info* as a zero-copy memoryview. The view
+        is only valid while the bundle is open.
+        """
+        end = info.start + info.gzip_len
+
+        if end > len(self.map):
+            raise BundleError(f"{info.path}: data extend beyond end of bundle")
+
+        return self.view[info.start : end]
+
+    def read_range(self, start, gzip_len, real_len):
+        end = start + gzip_len
+
+        if end > len(self.map):
+            raise BundleError(f"{self.path}: range {start}+{gzip_len} out of bounds")
+
+        # Release the slice promptly, even on errors, so that the mapping can
+        # always be closed.
+        with self.view[start:end] as data:
+            try:
+                return decompress(data, real_len)
+            except zlib.error as e:
+                raise BundleError(f"{self.path}: bad data at {start}: {e}") from None
+
+    def read(self, path):
+        """
+        Get the decompressed contents of the file at *path*, which must be a
+        full path within the bundle.
+        """
+        try:
+            info = self.files[path]
+        except KeyError:
+            raise BundleError(f"no such file {path!r} in bundle")
+
+        return self.read_range(info.start, info.gzip_len, info.real_len)
+
+    def search(self, name, order=None):
+        """
+        Resolve *name* the way the engine would, returning a FileInfo or None.
+
+        Names containing a slash must uniquely match the end of a path in the
+        bundle. Bare names are looked up in the search order named *order*,
+        or the default one: the first rule with any matching file wins, ties
+        being broken alphabetically. Rules ending in `//` match files in any
+        subdirectory.
+        """
+        if order is None:
+            order = self.default_search
+
+        try:
+            return self._search_cache[name, order]
+        except KeyError:
+            pass
+
+        result = self._search(name, order)
+        self._search_cache[name, order] = result
+        return result
+
+    def _search(self, name, order):
+        if name.startswith("/"):
+            return None
+
+        candidates = self.by_name.get(file_name(name), [])
+
+        if "/" in name:
+            matching = [i for i in candidates if i.path.endswith(name)]
+
+            if len(matching) != 1:
+                return None
+
+            return matching[0]
+
+        for rule in self.search_orders.get(order, []):
+            # Search rules start with a slash, but bundle paths don't.
+            rule = rule[1:]
+
+            if rule.endswith("//"):
+                prefix = rule[:-1]
+                picked = [i for i in candidates if i.path.startswith(prefix)]
+            else:
+                picked = [i for i in candidates if i.path[: -len(name)] == rule]
+
+            if picked:
+                return min(picked, key=lambda i: i.path)
+
+        return None
+
+    def reachable(self, orders=None):
+        """
+        Get the set of paths that can be found by searching for their bare
+        names in any of the search orders named in *orders*, or just the
+        default one. Every other file in the bundle is shadowed or outside of
+        the search path.
+        """
+        if orders is None:
+            orders = [self.default_search]
+
+        return set(
+            info.path
+            for order in orders
+            for name in self.by_name
+            for info in [self.search(name, order)]
+            if info is not None
+        )
+
+
+# Command-line interface
+
+
+def do_info(bundle, settings):
+    total_gzip = sum(i.gzip_len for i in bundle)
+    total_real = sum(i.real_len for i in bundle)
+
+    print(f"digest:         {bundle.digest}")
+    print(f"files:          {len(bundle)}")
+    print(f"index:          {bundle.index_start}+{bundle.index_gzip_len}")
+    print(f"compressed:     {total_gzip}")
+    print(f"uncompressed:   {total_real}")
+    print(f"default search: {bundle.default_search}")
+
+    for rule in bundle.search_orders.get(bundle.default_search, []):
+        print(f"  {rule}")
+
+
+def do_list(bundle, settings):
+    for info in bundle:
+        print(info.start, info.gzip_len, info.real_len, info.hash or "nohash", info.path)
+
+
+def do_cat(bundle, settings):
+    for path in settings.names:
+        sys.stdout.buffer.write(bundle.read(path))
+
+
+def do_search(bundle, settings):
+    n_missing = 0
+
+    for name in settings.names:
+        info = bundle.search(name)
+
+        if info is None:
+            print(f"{name}: not found")
+            n_missing += 1
+        else:
+            print(f"{name}: {info.path}")
+
+    return 1 if n_missing else 0
+
+
+def entrypoint(argv):
+    settings = make_arg_parser().parse_args(argv[1:])
+
+    try:
+        with TTBv1Bundle(settings.bundle) as bundle:
+            return settings.func(bundle, settings) or 0
+    except BundleError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+
+def make_arg_parser():
+    p = argparse.ArgumentParser()
+    commands = p.add_subparsers(dest="command", required=True)
+
+    def add(name, func, help, with_names=False):
+        sp = commands.add_parser(name, help=help)
+        sp.set_defaults(func=func)
+        sp.add_argument("bundle", help="The path to a `.ttb` bundle")
+
+        if with_names:
+            sp.add_argument("names", nargs="+", metavar="name")
+
+    add("info", do_info, "Print summary information about a bundle")
+    add("list", do_list, "Print the bundle's file list")
+    add("cat", do_cat, "Print the contents of files, by full path", with_names=True)
+    add(
+        "search",
+        do_search,
+        "Resolve file names using the bundle's search order",
+        with_names=True,
+    )
+    return p
+
+
+if __name__ == "__main__":
+    sys.exit(entrypoint(sys.argv))
@@ -0,0 +1,351 @@
+#! /usr/bin/env python3
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2024 the Tectonic Project.
+# Licensed under the MIT License.
+
+"""
+Check the integrity of a TTBv1 bundle.
+
+Every file listed in the bundle index is decompressed and checked against the
+SHA256 hash and decompressed length recorded in the index. We also check that
+the entries don't overlap and lie within the bundle, and that the bundle hash
+stored in the header matches both the hash of the bundled `FILELIST` (which is
+how it's computed in the first place) and the contents of `SHA256SUM`.
+
+The entries are sorted by offset and split into contiguous, non-overlapping
+byte ranges that are verified on a pool of worker processes, each of which
+maps the bundle independently.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import mmap
+import os
+import sys
+import time
+
+import ttbv1
+
+# Target amount of compressed data per unit of work. Small enough to keep all
+# workers busy until the end, large enough that scheduling overhead is noise.
+CHUNK_BYTES = 32 * 1024 * 1024
+
+# These are the state of each worker process, set up by `init_worker()`.
+worker_map = None
+worker_view = None
+
+
+def init_worker(path):
+    global worker_map, worker_view
+
+    with open(path, "rb") as f:
+        worker_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    worker_view = memoryview(worker_map)
+
+
+def verify_chunk(entries):
+    """
+    Verify a list of FileInfo records in a worker process. Returns a tuple of
+    `(problems, n_verified, n_gzip_bytes, n_real_bytes)`, where *n_verified*
+    doesn't count the files that couldn't be decompressed.
+    """
+    problems = []
+    n_verified = 0
+    n_gzip = 0
+    n_real = 0
+
+    for info in entries:
+        with worker_view[info.start : info.start + info.gzip_len] as data:
+            try:
+                content = ttbv1.decompress(data, info.real_len)
+            except Exception as e:
+                problems.append(f"{info.path}: cannot decompress: {e}")
+                continue
+
+        n_verified += 1
+        n_gzip += info.gzip_len
+        n_real += len(content)
+
+        if len(content) != info.real_len:
+            problems.append(
+                f"{info.path}: length is {len(content)}, expected {info.real_len}"
+            )
+
+        if info.hash is not None:
+            digest = hashlib.sha256(content).hexdigest()
+
+            if digest != info.hash:
+                problems.append(f"{info.path}: hash is {digest}, expected {info.hash}")
+
+    return problems, n_verified, n_gzip, n_real
+
+
+def check_layout(bundle):
+    """
+    Check that the index entries lie after the header, within the file, and
+    don't overlap each other or the index. Entries with identical contents
+    may share one blob, which doesn't count as an overlap. Returns a list of
+    problems and the entries sorted by offset.
+    """
+    problems = []
+    entries = sorted(bundle, key=lambda i: i.start)
+    size = len(bundle.map)
+
+    regions = [(info.start, info.gzip_len, info.path) for info in entries]
+    regions.append((bundle.index_start, bundle.index_gzip_len, "(index)"))
+    regions.sort()
+
+    prev_end = ttbv1.HEADER_SIZE
+    prev_name = "(header)"
+    prev_region = None
+
+    for start, length, name in regions:
+        if (start, length) == prev_region:
+            continue
+
+        prev_region = (start, length)
+
+        if start < prev_end:
+            problems.append(f"{name}: overlaps {prev_name}")
+
+        if start + length > size:
+            problems.append(f"{name}: extends beyond the end of the bundle")
+
+        if start + length > prev_end:
+            prev_end = start + length
+            prev_name = name
+
+    return problems, [i for i in entries if i.start + i.gzip_len <= size]
+
+
+def check_digest(bundle):
+    """
+    Check the header hash against the bundled FILELIST and SHA256SUM, and
+    check that FILELIST agrees with the index.
+    """
+    problems = []
+
+    try:
+        filelist = bundle.read("FILELIST")
+    except ttbv1.BundleError as e:
+        return [f"cannot read FILELIST: {e}"]
+
+    digest = hashlib.sha256(filelist).hexdigest()
+
+    if digest != bundle.digest:
+        problems.append(f"FILELIST hash is {digest}, header says {bundle.digest}")
+
+    try:
+        sumtext = bundle.read("SHA256SUM").decode("utf8").strip()
+    except (ttbv1.BundleError, UnicodeDecodeError) as e:
+        problems.append(f"cannot read SHA256SUM: {e}")
+    else:
+        if sumtext != bundle.digest:
+            problems.append(f"SHA256SUM is {sumtext}, header says {bundle.digest}")
+
+    # FILELIST lines are `<hash> <path>`.
+    listed = {}
+
+    for line in filelist.decode("utf8").splitlines():
+        hash, _, path = line.partition(" ")
+        listed[path] = None if hash == "nohash" else hash
+
+    indexed = dict((info.path, info.hash) for info in bundle)
+
+    for path in sorted(listed.keys() - indexed.keys()):
+        problems.append(f"{path}: in FILELIST but not the index")
+
+    for path in sorted(indexed.keys() - listed.keys()):
+        problems.append(f"{path}: in the index but not FILELIST")
+
+    for path in sorted(listed.keys() & indexed.keys()):
+        if listed[path] != indexed[path]:
+            problems.append(f"{path}: FILELIST and index hashes differ")
+
+    return problems
+
+
+def make_chunks(entries, n_workers):
+    """
+    Split *entries*, sorted by offset, into contiguous runs. We aim for at
+    least a few chunks per worker so that the load stays balanced.
+    """
+    total = sum(i.gzip_len for i in entries)
+    target = min(CHUNK_BYTES, max(total // (4 * n_workers), 1))
+    chunks = []
+    chunk = []
+    size = 0
+
+    for info in entries:
+        chunk.append(info)
+        size += info.gzip_len
+
+        if size >= target:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def format_rate(n_bytes, elapsed):
+    return f"{n_bytes / max(elapsed, 1e-6) / 1048576:.1f} MiB/s"
+
+
+def entrypoint(argv):
+    settings = make_arg_parser().parse_args(argv[1:])
+    t0 = time.monotonic()
+
+    try:
+        bundle = ttbv1.TTBv1Bundle(settings.bundle)
+    except (OSError, ttbv1.BundleError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    with bundle:
+        print(f"note: bundle hash is {bundle.digest}")
+        print(f"note: index lists {len(bundle)} files")
+
+        problems, entries = check_layout(bundle)
+        problems += check_digest(bundle)
+
+    total_gzip = sum(i.gzip_len for i in entries)
+    n_done = 0
+    n_verified = 0
+    n_gzip = 0
+    n_real = 0
+    chunks = make_chunks(entries, settings.jobs)
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=settings.jobs,
+        initializer=init_worker,
+        initargs=(settings.bundle,),
+    ) as pool:
+        futures = dict(
+            (pool.submit(verify_chunk, chunk), len(chunk)) for chunk in chunks
+        )
+
+        for future in concurrent.futures.as_completed(futures):
+            chunk_problems, chunk_verified, chunk_gzip, chunk_real = future.result()
+            problems += chunk_problems
+            n_done += futures[future]
+            n_verified += chunk_verified
+            n_gzip += chunk_gzip
+            n_real += chunk_real
+
+            if not settings.quiet:
+                elapsed = time.monotonic() - t0
+                pct = 100 * n_gzip // max(total_gzip, 1)
+                print(
+                    f"\r{n_done}/{len(entries)} files, {pct}%, "
+                    f"{format_rate(n_gzip, elapsed)} compressed  ",
+                    end="",
+                    file=sys.stderr,
+                    flush=True,
+                )
+
+    if not settings.quiet:
+        print(file=sys.stderr)
+
+    elapsed = time.monotonic() - t0
+
+    for problem in sorted(problems):
+        print("BAD", problem)
+
+    print()
+    print("Summary:")
+    print(
+        f"- Verified {n_verified} files using {settings.jobs} workers in {elapsed:.1f}s"
+    )
+    print(
+        f"- Read {n_gzip} compressed bytes ({format_rate(n_gzip, elapsed)}), "
+        f"{n_real} uncompressed ({format_rate(n_real, elapsed)})"
+    )
+
+    if problems:
+        print(f"- {len(problems)} problems: bundle is damaged")
+        return 1
+
+    print("- no problems: bundle is intact")
+    return 0
+
+
+def positive_int(text):
+    """
+    An argparse type for counts that must be at least 1.
+    """
+    value = int(text)
+
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+
+    return value
+
+
+def non_negative_int(text):
+    """
+    An argparse type for counts that may be 0.
+    """
+    value = int(text)
+
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"must be at least 0, not {value}")
+
+    return value
+
+
+def positive_float(text):
+    """
+    An argparse type for amounts, like timeouts, that must be more than 0.
+    """
+    value = float(text)
+
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"must be more than 0, not {value}")
+
+    return value
+
+
+def non_negative_float(text):
+    """
+    An argparse type for amounts, like delays and rates, that can't be
+    negative.
+    """
+    value = float(text)
+
+    if not value >= 0:
+        raise argparse.ArgumentTypeError(f"must be at least 0, not {value}")
+
+    return value
+
+
+def make_arg_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=positive_int,
+        default=os.cpu_count() or 1,
+        help="The number of worker processes to use (default: one per CPU)",
+    )
+    p.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Don't print progress while verifying",
+    )
+    p.add_argument(
+        "bundle",
+        help="The path to the `.ttb` bundle to check",
+    )
+    return p
+
+
+if __name__ == "__main__":
+    sys.exit(entrypoint(sys.argv))
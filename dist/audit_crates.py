@@ -1,66 +1,36 @@
-import os
-import re
-import json
-import urllib.request
-import urllib.error
+import argparse
+
+from cratesio import CratesIoError, add_client_arguments, make_client
+from workspace import Workspace, published_name
 
 # Audit script to check published versions of FerroTeX crates
 # standardizes on finding jxoesneon- prefixed crates
 
 def get_crate_names():
-    crates = []
-    # Root crate
-    crates.append(("tectonic", "jxoesneon-tectonic"))
-    
-    # Sub crates
-    crates_root = "crates"
-    if os.path.exists(crates_root):
-        for item in os.listdir(crates_root):
-            if not os.path.isdir(os.path.join(crates_root, item)):
-                continue
-            toml_path = os.path.join(crates_root, item, "Cargo.toml")
-            if os.path.exists(toml_path):
-                with open(toml_path, "r") as f:
-                    content = f.read()
-                match = re.search(r'\[package\]\nname = "(.*?)"', content)
-                if match:
-                    orig_name = match.group(1)
-                    if orig_name == "tectonic":
-                        pub_name = "jxoesneon-tectonic"
-                    elif orig_name.startswith("tectonic_"):
-                        pub_name = f'jxoesneon-{orig_name.replace("tectonic_", "tectonic-")}'
-                    else:
-                        pub_name = f'jxoesneon-{orig_name}'
-                    crates.append((orig_name, pub_name))
-    return crates
+    return [(m.name, published_name(m.name)) for m in Workspace.load(".").crates()]
 
-def fetch_versions(pub_name):
-    url = f"https://crates.io/api/v1/crates/{pub_name}"
+def fetch_versions(client, pub_name):
     try:
-        req = urllib.request.Request(
-            url, 
-            headers={'User-Agent': 'ferrotex-audit (jxoesneon/tectonic)'}
-        )
-        with urllib.request.urlopen(req) as response:
-            data = json.loads(response.read().decode())
-            versions = [v["num"] for v in data.get("versions", [])]
-            return versions
-    except urllib.error.HTTPError as e:
-        if e.code == 404:
-            return None # Not published yet
-        return f"Error: {e}"
-    except Exception as e:
+        return client.crate_versions(pub_name) # None if not published yet
+    except CratesIoError as e:
         return f"Error: {e}"
 
 def main():
-    print(f"{'Original Name':<30} | {'Published Name':<40} | {'Versions'}")
-    print("-" * 100)
-    
+    parser = argparse.ArgumentParser(description="Audit published versions of the fork's crates")
+    add_client_arguments(parser)
+    args = parser.parse_args()
+
     crates = get_crate_names()
     crates.sort()
+
+    # Fetch everything up front, concurrently, then print in order.
+    with make_client(args, user_agent='ferrotex-audit (jxoesneon/tectonic)') as client:
+        results = client.map(lambda crate: fetch_versions(client, crate[1]), crates)
+
+    print(f"{'Original Name':<30} | {'Published Name':<40} | {'Versions'}")
+    print("-" * 100)
     
-    for orig, pub in crates:
-        versions = fetch_versions(pub)
+    for (orig, pub), versions in zip(crates, results):
         if versions is None:
             ver_str = "(Not Published)"
         elif isinstance(versions, str):
@@ -70,5 +40,8 @@ def main():
             
         print(f"{orig:<30} | {pub:<40} | {ver_str}")
 
+    print()
+    print(f"{client.n_requests} API requests, {client.n_not_modified} answered from cache")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,298 @@
+import argparse
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+# Shared crates.io API client for the release scripts.
+#
+# - Connections are kept open and reused from a small pool, instead of
+#   opening a new one for every request.
+# - Requests can be made from many threads at once; a shared RateLimiter
+#   keeps us within the crates.io crawler policy (1 req/sec).
+# - Responses are cached on disk and revalidated with If-None-Match, so
+#   unchanged crates cost a 304 instead of the full version history.
+# - "Is version X published" is answered from the cache when it already
+#   lists that version, since published versions never go away. Otherwise
+#   only that version's record is fetched, not the whole version history.
+#
+# The base URL can be changed (--base-url or $CRATES_IO_URL) to run against a
+# local stub server that serves /api/v1/crates/{name} and
+# /api/v1/crates/{name}/{version}.
+
+DEFAULT_BASE_URL = "https://crates.io"
+DEFAULT_USER_AGENT = "ferrotex-release-bot (jxoesneon/tectonic)"
+API_DELAY_SEC = 1.0 # 1 second between API calls
+MAX_CONNECTIONS = 4
+TIMEOUT_SEC = 30
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "tectonic-dist", "cratesio")
+
+class CratesIoError(Exception):
+    pass
+
+class RateLimiter:
+    """Space out calls from any number of threads by at least `interval` seconds."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+class ResponseCache:
+    """
+    On-disk cache of JSON responses and their ETags, one file per request
+    path. Writes are atomic, so concurrent readers never see partial files.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _file(self, path):
+        return os.path.join(self.cache_dir, hashlib.sha256(path.encode("utf8")).hexdigest() + ".json")
+
+    def get(self, path):
+        try:
+            with open(self._file(path), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("path") != path:
+            return None
+        return entry
+
+    def put(self, path, etag, data):
+        entry = {"path": path, "etag": etag, "data": data}
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, self._file(path))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+class CratesIoClient:
+    def __init__(self, base_url=None, user_agent=DEFAULT_USER_AGENT, cache_dir=None,
+                 interval=API_DELAY_SEC, max_connections=MAX_CONNECTIONS):
+        base_url = base_url or os.environ.get("CRATES_IO_URL") or DEFAULT_BASE_URL
+        url = urllib.parse.urlsplit(base_url)
+        if url.scheme not in ("http", "https"):
+            raise ValueError(f"unsupported base URL {base_url!r}")
+
+        self.scheme = url.scheme
+        self.netloc = url.netloc
+        self.prefix = url.path.rstrip("/")
+        self.user_agent = user_agent
+        self.limiter = RateLimiter(interval)
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self.max_connections = max_connections
+        self.pool = queue.LifoQueue()
+        # Bounds the number of connections, idle or in use.
+        self.slots = threading.Semaphore(max_connections)
+        self.n_requests = 0
+        self.n_not_modified = 0
+        self.n_cache_hits = 0
+        self.stats_lock = threading.Lock()
+
+    def _connect(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.netloc, timeout=TIMEOUT_SEC)
+        return http.client.HTTPConnection(self.netloc, timeout=TIMEOUT_SEC)
+
+    def _request(self, path, headers):
+        """Make one GET request on a pooled connection, returning (status, headers, body)."""
+        # Wait our turn before taking a connection, so that waiting threads
+        # don't hold connections that others could be using.
+        self.limiter.wait()
+
+        with self.slots:
+            try:
+                conn = self.pool.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = self._connect()
+                reused = False
+
+            with self.stats_lock:
+                self.n_requests += 1
+
+            try:
+                conn.request("GET", self.prefix + path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # The server may have dropped an idle connection; try once more
+                # on a fresh one before giving up.
+                if not reused:
+                    raise CratesIoError(f"request for {path} failed: {e}") from None
+                conn = self._connect()
+                self.limiter.wait()
+                with self.stats_lock:
+                    self.n_requests += 1
+                try:
+                    conn.request("GET", self.prefix + path, headers=headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, OSError) as e:
+                    conn.close()
+                    raise CratesIoError(f"request for {path} failed: {e}") from None
+
+            if response.will_close:
+                conn.close()
+            else:
+                self.pool.put(conn)
+
+            return response.status, response.headers, body
+
+    def get_json(self, path):
+        """
+        GET an API path such as `/api/v1/crates/foo`, returning the decoded
+        JSON, or None if the server says 404. Cached responses are revalidated
+        with their ETag.
+        """
+        headers = {"User-Agent": self.user_agent, "Accept": "application/json"}
+        cached = self.cache.get(path) if self.cache else None
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+
+        status, response_headers, body = self._request(path, headers)
+
+        if status == 304 and cached:
+            with self.stats_lock:
+                self.n_not_modified += 1
+            return cached["data"]
+        if status == 404:
+            return None
+        if status != 200:
+            raise CratesIoError(f"GET {path}: HTTP {status}")
+
+        try:
+            data = json.loads(body.decode("utf8"))
+        except ValueError as e:
+            raise CratesIoError(f"GET {path}: bad JSON: {e}") from None
+
+        if self.cache:
+            self.cache.put(path, response_headers.get("ETag"), data)
+        return data
+
+    def crate_path(self, name):
+        return f"/api/v1/crates/{urllib.parse.quote(name)}"
+
+    def crate_versions(self, name):
+        """All published version numbers of a crate, newest first, or None if it doesn't exist."""
+        data = self.get_json(self.crate_path(name))
+        if data is None:
+            return None
+        return [v["num"] for v in data.get("versions", [])]
+
+    def version_path(self, name, version):
+        return f"{self.crate_path(name)}/{urllib.parse.quote(version)}"
+
+    def version_info(self, name, version):
+        """The API record for one version of a crate, or None if it isn't published."""
+        data = self.get_json(self.version_path(name, version))
+        if data is None or data.get("version", {}).get("num") != version:
+            return None
+        return data["version"]
+
+    def is_published(self, name, version):
+        # Versions can be yanked but never removed, so if the cached crate
+        # record lists this version there's no need to ask again. Otherwise
+        # ask about just this version, which is a much smaller response than
+        # the crate's full version history.
+        if self.cache:
+            cached = self.cache.get(self.crate_path(name))
+            listed = cached and any(v["num"] == version for v in cached["data"].get("versions", []))
+            cached = self.cache.get(self.version_path(name, version))
+            if listed or (cached and cached["data"].get("version", {}).get("num") == version):
+                with self.stats_lock:
+                    self.n_cache_hits += 1
+                return True
+
+        return self.version_info(name, version) is not None
+
+    def map(self, func, items):
+        """Call `func` on each of `items` concurrently, returning the results in order."""
+        items = list(items)
+        if not items:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(items), self.max_connections)) as pool:
+            return list(pool.map(func, items))
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def add_client_arguments(parser):
+    """Add the options for make_client() to an argparse parser."""
+    parser.add_argument("--base-url", help=f"API server to talk to (default: $CRATES_IO_URL or {DEFAULT_BASE_URL})")
+    parser.add_argument("--cache-dir", default=default_cache_dir(), help="Where to cache API responses")
+    parser.add_argument("--no-cache", action="store_true", help="Don't use or update the response cache")
+    parser.add_argument("--api-interval", type=float, default=API_DELAY_SEC,
+                        help="Minimum seconds between API requests (crates.io asks for 1)")
+
+def make_client(args, user_agent=DEFAULT_USER_AGENT):
+    return CratesIoClient(
+        base_url=args.base_url,
+        user_agent=user_agent,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        interval=args.api_interval,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the crates.io API")
+    add_client_arguments(parser)
+    parser.add_argument("name", help="Crate name")
+    parser.add_argument("version", nargs="?", help="Check whether this version is published")
+    args = parser.parse_args()
+
+    with make_client(args) as client:
+        try:
+            if args.version:
+                published = client.is_published(args.name, args.version)
+                print(f"{args.name} v{args.version}: {'published' if published else 'not published'}")
+                return 0 if published else 1
+
+            versions = client.crate_versions(args.name)
+        except CratesIoError as e:
+            print(f"Error: {e}")
+            return 1
+
+    if versions is None:
+        print(f"{args.name}: not published")
+        return 1
+    print(f"{args.name}: {', '.join(versions)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
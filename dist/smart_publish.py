@@ -1,49 +1,19 @@
 import argparse
+import concurrent.futures
 import subprocess
+import threading
 import time
 import sys
-import os
-import urllib.request
-import urllib.error
-import json
+
+from cratesio import CratesIoError, add_client_arguments, make_client
+from workspace import Workspace, WorkspaceError
 
 # Rate Limitations from crates.io
 # Publish: 1 req/min (refill), Burst 30.
-# API: 1 req/sec.
+# API: 1 req/sec, enforced by the shared client in cratesio.py.
 
 BURST_LIMIT = 30
 REFILL_RATE_SEC = 61 # 1 token per 61 seconds for safety
-API_DELAY_SEC = 1.0 # 1 second between API calls
-
-# Topological order of crates to publish
-CRATES = [
-    "crates/errors",
-    "crates/status_base",
-    "crates/io_base",
-    "crates/dep_support",
-    "crates/cfg_support",
-    "crates/mac_core",
-    "crates/bridge_core",
-    "crates/bridge_flate",
-    "crates/bridge_png",
-    "crates/bridge_freetype2",
-    "crates/bridge_graphite2",
-    "crates/bridge_harfbuzz",
-    "crates/bridge_icu",
-    "crates/bridge_fontconfig",
-    "crates/geturl",
-    "crates/xdv",
-    "crates/bundles",
-    "crates/docmodel",
-    "crates/xetex_format",
-    "crates/engine_bibtex",
-    "crates/pdf_io",
-    "crates/engine_xdvipdfmx",
-    "crates/xetex_layout",
-    "crates/engine_xetex",
-    "crates/engine_spx2html",
-    "."
-]
 
 class TokenBucket:
     def __init__(self, capacity, refill_rate_sec):
@@ -51,13 +21,15 @@ class TokenBucket:
         self.tokens = capacity
         self.last_refill = time.time()
         self.refill_rate_sec = refill_rate_sec
+        self.lock = threading.Lock()
 
     def consume(self):
-        self.refill()
-        if self.tokens >= 1:
-            self.tokens -= 1
-            return True
-        return False
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
 
     def refill(self):
         now = time.time()
@@ -70,103 +42,136 @@ class TokenBucket:
             self.last_refill = now
             
     def time_until_next_token(self):
-        self.refill()
-        if self.tokens >= 1:
-            return 0
-        
-        # How much of a token do we need?
-        needed = 1.0 - self.tokens
-        return needed * self.refill_rate_sec
-
-def get_pkg_info(crate_path):
-    toml_path = os.path.join(crate_path, "Cargo.toml")
-    name = None
-    version = None
-    
-    with open(toml_path, "r") as f:
-        for line in f:
-            line = line.split('#')[0].strip()
-            if line.startswith("name ="):
-                name = line.split('=')[1].strip().strip('"')
-            elif line.startswith("version ="):
-                version = line.split('=')[1].strip().strip('"')
-            
-            if name and version:
-                break
-                
-    return name, version
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                return 0
 
-def check_published(name, version):
-    url = f"https://crates.io/api/v1/crates/{name}/{version}"
+            # How much of a token do we need?
+            needed = 1.0 - self.tokens
+            return needed * self.refill_rate_sec
+
+    def take(self, label):
+        """Block until a token is available, then consume it."""
+        while not self.consume():
+            wait_time = self.time_until_next_token()
+            print(f"[{label}] Rate Limit Hit! Waiting {wait_time:.1f}s for token refill...")
+            time.sleep(wait_time + 1) # +1 buffer
+
+def check_published(client, name, version):
     try:
-        # User-Agent required by crates.io policy
-        req = urllib.request.Request(
-            url, 
-            headers={'User-Agent': 'ferrotex-release-bot (jxoesneon/tectonic)'}
-        )
-        with urllib.request.urlopen(req) as response:
-            data = json.loads(response.read().decode())
-            if "version" in data and data["version"]["num"] == version:
-                return True
-    except urllib.error.HTTPError as e:
-        if e.code == 404:
-            return False
+        return client.is_published(name, version)
+    except CratesIoError as e:
         print(f"  Warning: API check failed for {name} v{version}: {e}")
         return False
-    except Exception as e:
-        print(f"  Warning: API check failed for {name} v{version}: {e}")
-        return False
-        
-    return False
 
 def main():
     parser = argparse.ArgumentParser(description="Smart crate publisher with rate limiting")
     parser.add_argument("token", help="Cargo registry token")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="Maximum number of concurrent uploads")
+    add_client_arguments(parser)
     args = parser.parse_args()
-    
-    bucket = TokenBucket(BURST_LIMIT, REFILL_RATE_SEC)
-    
-    print(f"Starting Smart Publish. Burst: {BURST_LIMIT}, Refill: 1/{REFILL_RATE_SEC}s")
-    
-    for crate_path in CRATES:
-        name, version = get_pkg_info(crate_path)
-        if not name or not version:
-            print(f"Error: Could not parse Cargo.toml for {crate_path}")
+
+    try:
+        ws = Workspace.load(".")
+        graph = ws.graph()
+        order = ws.publish_order()
+    except WorkspaceError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    info = {}
+    for crate_path in order:
+        m = ws.manifests[crate_path]
+        if not m.version:
+            print(f"Error: No package version in {m.path}")
             sys.exit(1)
-            
-        print(f"[{name} v{version}] Checking status...")
-        
-        # Respect API Rate limit (1 req/sec)
-        time.sleep(API_DELAY_SEC)
-        
-        if check_published(name, version):
-            print(f"  Skipping: Already published.")
-            continue
-            
-        # Needs publish. Check tokens.
-        while not bucket.consume():
-            wait_time = bucket.time_until_next_token()
-            print(f"  Rate Limit Hit! Waiting {wait_time:.1f}s for token refill...")
-            time.sleep(wait_time + 1) # +1 buffer
-            
-        print(f"  Publishing... (Tokens left: {bucket.tokens:.2f})")
-        
+        info[crate_path] = (m.name, m.version)
+
+    client = make_client(args)
+    bucket = TokenBucket(BURST_LIMIT, REFILL_RATE_SEC)
+
+    print(f"Starting Smart Publish. {len(order)} crates, Burst: {BURST_LIMIT}, Refill: 1/{REFILL_RATE_SEC}s")
+
+    def check(crate_path):
+        # The client keeps all checks within the API rate limit, and answers
+        # from its cache for versions it has already seen published.
+        return check_published(client, *info[crate_path])
+
+    def publish(crate_path):
+        name, version = info[crate_path]
+        bucket.take(f"{name} v{version}")
+        print(f"[{name} v{version}] Publishing... (Tokens left: {bucket.tokens:.2f})")
+
         cmd = [
-            "cargo", "publish", 
+            "cargo", "publish",
             "--token", args.token,
-            "--no-verify", 
+            "--no-verify",
             "--allow-dirty",
-            "--manifest-path", os.path.join(crate_path, "Cargo.toml")
+            "--manifest-path", ws.manifests[crate_path].path
         ]
-        
-        try:
-             # Capture output to avoid noisy logs unless error
-            subprocess.run(cmd, check=True, capture_output=True)
-            print("  Success!")
-        except subprocess.CalledProcessError as e:
-            print(f"  Error publishing {name}:")
-            print(e.stderr.decode())
-            sys.exit(1)
+
+        # Capture output to avoid noisy logs unless error. `cargo publish`
+        # waits until the new version is in the index, so dependents can be
+        # started as soon as it returns.
+        return subprocess.run(cmd, capture_output=True)
+
+    # A crate is done once it's known to be on crates.io. A crate that needs
+    # publishing is started once all of its internal deps are done.
+    done = set()
+    waiting = set()
+    failed = []
+    n_published = 0
+
+    with client, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=client.max_connections) as checkers, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as uploaders:
+        # Checks are submitted in dependency order, so the crates that unblock
+        # the most publishes are resolved first.
+        running = dict((checkers.submit(check, c), ("check", c)) for c in order)
+
+        while running:
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in finished:
+                kind, crate_path = running.pop(future)
+                name, version = info[crate_path]
+
+                if kind == "check":
+                    if future.result():
+                        print(f"[{name} v{version}] Skipping: Already published.")
+                        done.add(crate_path)
+                    else:
+                        print(f"[{name} v{version}] Needs publishing.")
+                        waiting.add(crate_path)
+                else:
+                    result = future.result()
+                    if result.returncode == 0:
+                        print(f"[{name} v{version}] Success!")
+                        done.add(crate_path)
+                        n_published += 1
+                    else:
+                        print(f"[{name} v{version}] Error publishing {name}:")
+                        print(result.stderr.decode())
+                        failed.append(crate_path)
+
+            # After a failure, let running uploads finish but don't start new ones.
+            if failed:
+                continue
+
+            for crate_path in sorted(waiting, key=order.index):
+                if graph[crate_path] <= done:
+                    waiting.discard(crate_path)
+                    running[uploaders.submit(publish, crate_path)] = ("publish", crate_path)
+
+    print(f"Published {n_published} crates, {len(order) - n_published - len(waiting) - len(failed)} already up to date.")
+
+    if failed or waiting:
+        for crate_path in failed:
+            print(f"  Failed: {info[crate_path][0]}")
+        for crate_path in sorted(waiting, key=order.index):
+            print(f"  Not published: {info[crate_path][0]}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
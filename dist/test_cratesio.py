@@ -0,0 +1,152 @@
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cratesio import CratesIoClient, CratesIoError
+
+# Tests for cratesio.py against a local stub of the crates.io API.
+# Usage: python3 dist/test_cratesio.py
+#
+# The stub serves /api/v1/crates/{name} and /api/v1/crates/{name}/{version}
+# for the crates in CRATES, with ETags, and records every request it gets.
+
+CRATES = {
+    "jxoesneon-tectonic": ["0.16.2", "0.16.1"],
+    "jxoesneon-tectonic-errors": ["0.17.3"],
+}
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.client_address[1]))
+
+        if server.fail_next:
+            server.fail_next = False
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        parts = self.path.split("/")[4:]
+        versions = CRATES.get(parts[0]) if parts else None
+
+        if versions is None or (len(parts) > 1 and parts[1] not in versions):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if len(parts) > 1:
+            data = {"version": {"num": parts[1], "crate": parts[0]}}
+        else:
+            data = {"crate": {"name": parts[0]}, "versions": [{"num": v} for v in versions]}
+
+        body = json.dumps(data).encode("utf8")
+        etag = f'"{len(body)}-{hash(body) & 0xffffffff:x}"'
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class CratesIoClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.fail_next = False
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.cache_dir = tempfile.mkdtemp()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def client(self, cache=True, **kwargs):
+        return CratesIoClient(
+            base_url=self.base_url,
+            cache_dir=self.cache_dir if cache else None,
+            interval=0,
+            **kwargs,
+        )
+
+    def paths(self):
+        return [path for path, _ in self.server.requests]
+
+    def test_versions_and_missing_crate(self):
+        with self.client() as client:
+            self.assertEqual(client.crate_versions("jxoesneon-tectonic"), ["0.16.2", "0.16.1"])
+            self.assertIsNone(client.crate_versions("jxoesneon-nope"))
+
+    def test_revalidates_with_etag(self):
+        with self.client() as client:
+            first = client.crate_versions("jxoesneon-tectonic")
+        with self.client() as client:
+            second = client.crate_versions("jxoesneon-tectonic")
+            self.assertEqual(client.n_not_modified, 1)
+        self.assertEqual(first, second)
+
+    def test_is_published_uses_version_endpoint(self):
+        with self.client() as client:
+            self.assertTrue(client.is_published("jxoesneon-tectonic", "0.16.2"))
+            self.assertFalse(client.is_published("jxoesneon-tectonic", "9.9.9"))
+            self.assertFalse(client.is_published("jxoesneon-nope", "0.1.0"))
+        self.assertEqual(self.paths(), [
+            "/api/v1/crates/jxoesneon-tectonic/0.16.2",
+            "/api/v1/crates/jxoesneon-tectonic/9.9.9",
+            "/api/v1/crates/jxoesneon-nope/0.1.0",
+        ])
+
+    def test_is_published_answers_from_cache(self):
+        with self.client() as client:
+            client.crate_versions("jxoesneon-tectonic")
+            client.is_published("jxoesneon-tectonic-errors", "0.17.3")
+        n_requests = len(self.server.requests)
+
+        with self.client() as client:
+            self.assertTrue(client.is_published("jxoesneon-tectonic", "0.16.1"))
+            self.assertTrue(client.is_published("jxoesneon-tectonic-errors", "0.17.3"))
+            self.assertEqual(client.n_cache_hits, 2)
+        self.assertEqual(len(self.server.requests), n_requests)
+
+    def test_reuses_pooled_connections(self):
+        names = sorted(CRATES) * 10
+        with self.client(cache=False, max_connections=2) as client:
+            results = client.map(client.crate_versions, names)
+        self.assertEqual(results, [CRATES[name] for name in names])
+        self.assertEqual(len(self.server.requests), len(names))
+        self.assertLessEqual(len(set(port for _, port in self.server.requests)), 2)
+
+    def test_http_error(self):
+        self.server.fail_next = True
+        with self.client(cache=False) as client:
+            with self.assertRaises(CratesIoError):
+                client.crate_versions("jxoesneon-tectonic")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,42 +1,13 @@
 import os
-import re
-import sys
+
+from workspace import Workspace, published_name
 
 # Script to update README.md for Tectonic crates in the FerroTeX fork
 # Usage: python3 dist/update_readmes.py
 
-def get_crate_metadata(toml_path):
-    with open(toml_path, "r") as f:
-        content = f.read()
-    
-    name_match = re.search(r'\[package\]\nname = "(.*?)"', content)
-    description_match = re.search(r'description = "(.*?)"', content, re.DOTALL)
-    readme_match = re.search(r'readme = "(.*?)"', content)
-    
-    if not name_match:
-        return None, None, None
-        
-    name = name_match.group(1)
-    description = description_match.group(1).replace('\n', ' ').strip() if description_match else "A Tectonic sub-crate."
-    readme_file = readme_match.group(1) if readme_match else "README.md"
-
-    # Handle multi-line descriptions that might have been matched greedily or weirdly
-    if '"""' in description:
-         pass
-
-    return name, description, readme_file
-
-def compute_published_name(name):
-    if name == "tectonic":
-        return "jxoesneon-tectonic"
-    elif name.startswith("tectonic_"):
-        return f'jxoesneon-{name.replace("tectonic_", "tectonic-")}'
-    else:
-        return f'jxoesneon-{name}'
-
 def update_readme(crate_dir, name, description, readme_filename):
     readme_path = os.path.join(crate_dir, readme_filename)
-    published_name = compute_published_name(name)
+    pub_name = published_name(name)
     
     existing_content = ""
     if os.path.exists(readme_path):
@@ -48,11 +19,11 @@ def update_readme(crate_dir, name, description, readme_filename):
     # Define the Standard Header
     header = f"""# The `{name}` crate
 
-[![](http://meritbadge.herokuapp.com/{published_name})](https://crates.io/crates/{published_name})
+[![](http://meritbadge.herokuapp.com/{pub_name})](https://crates.io/crates/{pub_name})
 
 > [!NOTE]
 > This crate is part of the **FerroTeX** project, a specialized fork of Tectonic.
-> It is published to crates.io as `{published_name}`.
+> It is published to crates.io as `{pub_name}`.
 
 """
 
@@ -106,30 +77,11 @@ def update_readme(crate_dir, name, description, readme_filename):
     print(f"Updated {readme_path}")
 
 def main():
-    # Process root crate
-    toml_path = "Cargo.toml"
-    if os.path.exists(toml_path):
-        name, description, readme_file = get_crate_metadata(toml_path)
-        if name:
-             # For root, we purposefully might want to update CARGO_README.md, 
-             # but we should double check if that is what we want.
-             # Yes, crates.io uses the file pointed to by 'readme'.
-             update_readme(".", name, description, readme_file)
-
-    # Process sub-crates
-    crates_root = "crates"
-    for item in os.listdir(crates_root):
-        crate_dir = os.path.join(crates_root, item)
-        if not os.path.isdir(crate_dir):
-            continue
-            
-        toml_path = os.path.join(crate_dir, "Cargo.toml")
-        if not os.path.exists(toml_path):
-            continue
-            
-        name, description, readme_file = get_crate_metadata(toml_path)
-        if name:
-            update_readme(crate_dir, name, description, readme_file)
+    # The root crate first, then the sub-crates. For the root, crates.io
+    # shows the file pointed to by `readme`, which is CARGO_README.md.
+    for m in Workspace.load(".").crates():
+        description = m.description or "A Tectonic sub-crate."
+        update_readme(m.dir, m.name, description, m.readme or "README.md")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,359 @@
+import argparse
+import difflib
+import glob
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+# In-memory model of the workspace's Cargo manifests, shared by the fork's
+# release scripts.
+#
+# Every Cargo.toml is read and parsed once: the package name, version,
+# description and readme, the dependency keys (including the internal
+# `name = { path = "..." }` ones) and the `[features]` entries. Parsing is
+# line-based and keeps every line as it was, so that rewriting a value leaves
+# the rest of the file, comments included, untouched.
+#
+# The fork rename is applied to those lines in memory:
+#
+# - each package is renamed to its jxoesneon-* published name and given the
+#   new version;
+# - each internal dependency keeps its key and gets `package = "..."` and the
+#   new version, so `use tectonic_foo` in the Rust code and feature references
+#   such as "tectonic_foo/bar" keep working without being rewritten.
+#
+# The result can be shown as a diff before anything is written. Writing is
+# all-or-nothing: every changed manifest is first written to a temporary file
+# next to it, and only once all of them have been written are they moved into
+# place. If a move fails, the manifests already moved are put back.
+
+PREFIX = "jxoesneon-"
+
+SECTION_RE = re.compile(r'^\s*\[\s*([^\[\]]+?)\s*\]\s*$')
+KEY_RE = re.compile(r'^\s*([\w-]+)\s*=\s*(.*)$', re.S)
+STRING_VALUE_RE = re.compile(r'^(\s*[\w-]+\s*=\s*)"[^"]*"(.*)$', re.S)
+INLINE_TABLE_RE = re.compile(r'^(\s*[\w-]+\s*=\s*{)(.*)(}.*)$', re.S)
+FIELD_RE = re.compile(r'(?<![\w-])([\w-]+)\s*=\s*(["\'])([^"\']*)\2')
+STRING_RE = re.compile(r'"([^"]*)"')
+
+class WorkspaceError(Exception):
+    pass
+
+def published_name(name):
+    """The crates.io name of a workspace crate in the fork, e.g. tectonic_xdv -> jxoesneon-tectonic-xdv."""
+    if name.startswith(PREFIX):
+        return name
+    if name.startswith("tectonic_"):
+        return PREFIX + name.replace("tectonic_", "tectonic-", 1)
+    return PREFIX + name
+
+def strip_comment(line):
+    in_string = None
+    for i, c in enumerate(line):
+        if in_string:
+            if c == in_string:
+                in_string = None
+        elif c in "\"'":
+            in_string = c
+        elif c == "#":
+            return line[:i]
+    return line
+
+def bracket_depth(text):
+    """The number of [ and { left open in `text`, ignoring strings and comments."""
+    depth = 0
+    for line in text.splitlines():
+        line = strip_comment(line)
+        line = re.sub(r'"[^"]*"|\'[^\']*\'', "", line)
+        depth += line.count("[") + line.count("{") - line.count("]") - line.count("}")
+    return depth
+
+class Dependency:
+    """A single-line `key = { ... }` entry in one of the dependency tables."""
+
+    def __init__(self, key, section, lineno, fields):
+        self.key = key
+        self.section = section
+        self.lineno = lineno
+        self.path = fields.get("path")
+        self.package = fields.get("package")
+        self.version = fields.get("version")
+
+class Manifest:
+    def __init__(self, crate_dir, text):
+        self.dir = crate_dir
+        self.path = os.path.normpath(os.path.join(crate_dir, "Cargo.toml"))
+        self.original = text
+        self.lines = text.splitlines(keepends=True)
+        self.name = None
+        self.version = None
+        self.description = None
+        self.readme = None
+        # Line numbers of the single-line string values in [package].
+        self.package_lines = {}
+        self.dep_keys = set()
+        self.deps = []
+        self.features = {}
+        self.members = []
+        self._parse()
+
+    @classmethod
+    def read(cls, crate_dir):
+        path = os.path.join(crate_dir, "Cargo.toml")
+        try:
+            with open(path, "r", newline="") as f:
+                return cls(crate_dir, f.read())
+        except OSError as e:
+            raise WorkspaceError(f"cannot read {path}: {e}") from None
+
+    def _parse(self):
+        section = None
+        lineno = 0
+
+        while lineno < len(self.lines):
+            start = lineno
+            line = strip_comment(self.lines[lineno])
+            lineno += 1
+
+            m = SECTION_RE.match(line)
+            if m:
+                section = m.group(1)
+                continue
+
+            m = KEY_RE.match(line)
+            if not m:
+                continue
+
+            # Arrays and inline tables may continue over several lines.
+            key, value = m.group(1), m.group(2)
+            while bracket_depth(value) > 0 and lineno < len(self.lines):
+                value += strip_comment(self.lines[lineno])
+                lineno += 1
+            value = value.strip()
+
+            if section == "package":
+                m = STRING_RE.fullmatch(value)
+                if m and key in ("name", "version", "description", "readme"):
+                    setattr(self, key, m.group(1))
+                    self.package_lines[key] = start
+            elif section == "workspace" and key == "members":
+                self.members = STRING_RE.findall(value)
+            elif section == "features":
+                self.features[key] = STRING_RE.findall(value)
+            elif section is not None and section.split(".")[-1] in ("dependencies", "dev-dependencies", "build-dependencies"):
+                self.dep_keys.add(key)
+                if value.startswith("{") and start == lineno - 1:
+                    fields = dict((k, v) for k, _, v in FIELD_RE.findall(value))
+                    if "path" in fields:
+                        self.deps.append(Dependency(key, section, start, fields))
+
+    @property
+    def text(self):
+        return "".join(self.lines)
+
+    @property
+    def changed(self):
+        return self.text != self.original
+
+    def dep_dir(self, dep):
+        return os.path.normpath(os.path.join(self.dir, dep.path))
+
+    def set_package_value(self, key, value):
+        lineno = self.package_lines.get(key)
+        if lineno is None:
+            raise WorkspaceError(f"{self.path}: no `{key}` in [package]")
+        m = STRING_VALUE_RE.match(self.lines[lineno])
+        self.lines[lineno] = f'{m.group(1)}"{value}"{m.group(2)}'
+        setattr(self, key, value)
+
+    def set_dep_package(self, dep, package, version):
+        """Point an internal dependency at `package`, and at `version` if it names one."""
+        m = INLINE_TABLE_RE.match(self.lines[dep.lineno])
+        body = m.group(2)
+
+        if dep.package is None:
+            body = f' package = "{package}",{body}'
+        else:
+            body = re.sub(r'(?<![\w-])package\s*=\s*(["\'])[^"\']*\1', f'package = "{package}"', body)
+
+        if dep.version is not None:
+            body = re.sub(r'(?<![\w-])version\s*=\s*(["\'])[^"\']*\1', f'version = "{version}"', body)
+            dep.version = version
+
+        dep.package = package
+        self.lines[dep.lineno] = m.group(1) + body + m.group(3)
+
+    def broken_feature_refs(self):
+        """
+        Feature entries that name something other than a feature or a
+        dependency key, as (feature, reference) pairs.
+        """
+        broken = []
+        for feature, refs in self.features.items():
+            for ref in refs:
+                target = ref[4:] if ref.startswith("dep:") else ref.split("/")[0].rstrip("?")
+                if target not in self.features and target not in self.dep_keys:
+                    broken.append((feature, ref))
+        return broken
+
+class Workspace:
+    def __init__(self, root, manifests):
+        self.root = root
+        # Crate directory -> Manifest
+        self.manifests = manifests
+
+    @classmethod
+    def load(cls, root="."):
+        """
+        Read the root manifest, the workspace members, every crates/*/Cargo.toml,
+        and anything else reachable through `path =` deps, since not every
+        path dependency is listed as a member.
+        """
+        root = os.path.normpath(root)
+        top = Manifest.read(root)
+        manifests = {root: top}
+        todo = [os.path.normpath(os.path.join(root, m)) for m in top.members]
+        todo += [os.path.dirname(p) for p in glob.glob(os.path.join(root, "crates", "*", "Cargo.toml"))]
+        todo += [top.dep_dir(dep) for dep in top.deps]
+
+        while todo:
+            crate_dir = os.path.normpath(todo.pop())
+            if crate_dir in manifests:
+                continue
+            manifest = Manifest.read(crate_dir)
+            manifests[crate_dir] = manifest
+            todo += [manifest.dep_dir(dep) for dep in manifest.deps]
+
+        for manifest in manifests.values():
+            if manifest.name is None:
+                raise WorkspaceError(f"{manifest.path}: no package name")
+
+        return cls(root, manifests)
+
+    def crates(self):
+        """All manifests, the root crate first and then by directory."""
+        return [self.manifests[d] for d in sorted(self.manifests, key=lambda d: (d != self.root, d))]
+
+    def graph(self):
+        """Map every crate directory to the set of crate directories it depends on."""
+        return dict((d, set(m.dep_dir(dep) for dep in m.deps)) for d, m in self.manifests.items())
+
+    def publish_order(self):
+        """The crate directories in an order suitable for publishing."""
+        return topo_order(self.graph())
+
+    def rename_for_fork(self, new_version):
+        """
+        Rename every crate to its published name and set it and its internal
+        dependencies to `new_version`, in memory. Nothing is written until
+        commit().
+        """
+        # Dependencies are named by their target's current name, so look
+        # those up before any packages are renamed.
+        targets = {}
+        for m in self.manifests.values():
+            for dep in m.deps:
+                targets[(m.dir, dep.key)] = self.manifests[m.dep_dir(dep)].name
+
+        for m in self.manifests.values():
+            m.set_package_value("name", published_name(m.name))
+            if "version" in m.package_lines:
+                m.set_package_value("version", new_version)
+            for dep in m.deps:
+                m.set_dep_package(dep, published_name(targets[(m.dir, dep.key)]), new_version)
+
+        broken = [(m, f, ref) for m in self.crates() for f, ref in m.broken_feature_refs()]
+        if broken:
+            raise WorkspaceError("; ".join(f"{m.path}: feature {f} refers to unknown {ref!r}" for m, f, ref in broken))
+
+    def changed(self):
+        return [m for m in self.crates() if m.changed]
+
+    def diff(self):
+        """A unified diff of the pending changes to all manifests."""
+        out = []
+        for m in self.changed():
+            out += difflib.unified_diff(
+                m.original.splitlines(keepends=True), m.lines,
+                fromfile=f"a/{m.path}", tofile=f"b/{m.path}",
+            )
+        return "".join(out)
+
+    def commit(self):
+        """Write all changed manifests, or none of them. Returns the manifests written."""
+        changed = self.changed()
+        staged = []
+
+        try:
+            for m in changed:
+                fd, tmp = tempfile.mkstemp(dir=m.dir, prefix=".Cargo.toml.", suffix=".tmp")
+                staged.append((m, tmp))
+                with os.fdopen(fd, "w", newline="") as f:
+                    f.write(m.text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                shutil.copymode(m.path, tmp)
+        except BaseException:
+            for _, tmp in staged:
+                os.unlink(tmp)
+            raise
+
+        moved = []
+        try:
+            for m, tmp in staged:
+                os.replace(tmp, m.path)
+                moved.append(m)
+        except BaseException:
+            for m in moved:
+                with open(m.path, "w", newline="") as f:
+                    f.write(m.original)
+            for _, tmp in staged[len(moved):]:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+            raise
+
+        for m in changed:
+            m.original = m.text
+        return changed
+
+def topo_order(graph):
+    """
+    Order the crates so that each one comes after all of its dependencies.
+    Ties are broken alphabetically so that the order is stable.
+    """
+    remaining = dict((crate, set(deps)) for crate, deps in graph.items())
+    order = []
+
+    while remaining:
+        ready = sorted(crate for crate, deps in remaining.items() if not deps)
+        if not ready:
+            raise WorkspaceError(f"dependency cycle among: {', '.join(sorted(remaining))}")
+        for crate in ready:
+            del remaining[crate]
+            order.append(crate)
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+    return order
+
+def main():
+    parser = argparse.ArgumentParser(description="List the workspace crates in publishing order")
+    parser.add_argument("--root", default=".", help="Workspace root directory")
+    args = parser.parse_args()
+
+    try:
+        ws = Workspace.load(args.root)
+        order = ws.publish_order()
+    except WorkspaceError as e:
+        print(f"Error: {e}")
+        return 1
+
+    for crate_dir in order:
+        m = ws.manifests[crate_dir]
+        print(f"{crate_dir:<30} {m.name:<30} {m.version or '-':<10} {published_name(m.name)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,104 +1,18 @@
 import os
-import re
 import time
 import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "dist"))
+from workspace import Workspace, published_name
 
 # Tectonic Renaming and Publication Script for jxoesneon fork
 # This script renames crates to the jxoesneon-tectonic-* prefix and publishes them.
+# The renaming is done by dist/workspace.py, the same as in CI.
 
-PREFIX = "jxoesneon-"
 NEW_VERSION = "0.16.2"
 DELAY = 90  # seconds
 
-CRATES_ORDER = [
-    "crates/errors",
-    "crates/status_base",
-    "crates/io_base",
-    "crates/dep_support",
-    "crates/cfg_support",
-    "crates/mac_core",
-    "crates/bridge_core",
-    "crates/bridge_flate",
-    "crates/bridge_png",         # Must come before bridge_freetype2
-    "crates/bridge_freetype2",
-    "crates/bridge_graphite2",
-    "crates/bridge_harfbuzz",
-    "crates/bridge_icu",
-    "crates/bridge_fontconfig",
-    "crates/geturl",
-    "crates/xdv",
-    "crates/bundles",
-    "crates/docmodel",
-    "crates/xetex_format",
-    "crates/engine_bibtex",
-    "crates/pdf_io",
-    "crates/engine_xdvipdfmx",
-    "crates/xetex_layout",
-    "crates/engine_xetex",
-    "crates/engine_spx2html",
-    "." # Root tectonic crate
-]
-
-def rename_and_update(path):
-    print(f"Processing {path}...")
-    toml_path = os.path.join(path, "Cargo.toml")
-    with open(toml_path, "r") as f:
-        content = f.read()
-
-    # 1. Rename the package itself
-    # [package]
-    # name = "tectonic_..."
-    def rename_pkg(match):
-        name = match.group(1)
-        if name == "tectonic":
-            new_name = "jxoesneon-tectonic"
-        elif name.startswith("tectonic_"):
-            new_name = f'jxoesneon-{name.replace("tectonic_", "tectonic-")}'
-        else:
-            new_name = f'jxoesneon-{name}'
-        return f'[package]\nname = "{new_name}"'
-
-    content = re.sub(r'\[package\]\nname = "(tectonic(?:_[a-z0-9_]+)?)"', rename_pkg, content)
-
-    # 2. Update dependencies on local tectonic crates
-    # tectonic_errors = { path = "../errors", version = "..." }
-    def rename_dep(match):
-        dep_name = match.group(1)
-        rest = match.group(2)
-        if dep_name == "tectonic":
-            new_name = "jxoesneon-tectonic"
-        else:
-            new_name = f'jxoesneon-{dep_name.replace("tectonic_", "tectonic-")}'
-        # Also ensure we point to the NEW_VERSION, supporting both quote types
-        new_rest = re.sub(r"version = (['\"])[^'\"]+(['\"])", f'version = \\g<1>{NEW_VERSION}\\g<2>', rest)
-        return f'{new_name} = {{ {new_rest} }}'
-
-    content = re.sub(r'^(tectonic(?:_[a-z0-9_]+)?)\s*=\s*{\s*(path\s*=\s*"[^"]+".*?)}', rename_dep, content, flags=re.MULTILINE)
-
-    # 3. Update features that reference crates
-    # serialization = ["serde", "tectonic_docmodel", "toml"]
-    def rename_feature(match):
-        val = match.group(0)
-        # Find strings like "tectonic_docmodel" or "tectonic_docmodel/feat"
-        # and replace with "jxoesneon-tectonic-docmodel"
-        def repl_feat(m):
-            name = m.group(1)
-            suffix = m.group(2) or ""
-            if name == "tectonic":
-                return f'"jxoesneon-tectonic{suffix}"'
-            if name.startswith("tectonic_"):
-                return f'"jxoesneon-{name.replace("tectonic_", "tectonic-")}{suffix}"'
-            return f'"jxoesneon-{name}{suffix}"'
-        
-        return re.sub(r'"(tectonic(?:_[a-z0-9_]+)?)(/[^"]+)?"', repl_feat, val)
-
-    content = re.sub(r'^\[features\].*?(?=\n\[|\Z)', rename_feature, content, flags=re.MULTILINE | re.DOTALL)
-
-    # 4. Set version
-    content = re.sub(r'^version = "[^"]+"', f'version = "{NEW_VERSION}"', content, flags=re.MULTILINE)
-
-    with open(toml_path, "w") as f:
-        f.write(content)
 
 def publish(path):
     token = os.environ.get("CARGO_REGISTRY_TOKEN")
@@ -114,19 +28,55 @@ def publish(path):
         print(f"FAILED to publish {path}")
         return False
 
+def resolve_start(ws, order, start):
+    """
+    The index in `order` of the crate named by `start`: a crate directory, a
+    crate name, its published name, or an index into `order` itself.
+    """
+    if start.isdigit():
+        index = int(start)
+        if index >= len(order):
+            sys.exit(f"Error: --start-from {index} is past the last of {len(order)} crates")
+        return index
+    for i, crate_dir in enumerate(order):
+        name = ws.manifests[crate_dir].name
+        if start in (name, published_name(name)) or os.path.normpath(start) == crate_dir:
+            return i
+    sys.exit(f"Error: --start-from {start!r} is not a workspace crate")
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("--start-from", type=int, default=0, help="Index to start publishing from (0-indexed)")
+    parser.add_argument(
+        "--start-from", default="0",
+        help="Crate to start publishing from: a directory such as crates/xdv, a crate name, "
+        "or a 0-based index into the dependency order printed at startup. That order is "
+        "worked out from the manifests, so indices from older versions of this script, "
+        "which used a hand-written list, point at different crates",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Print the manifest changes and exit")
     args = parser.parse_args()
-    
+
+    ws = Workspace.load(".")
+    # Dependencies come before their dependents, as worked out from the
+    # `path =` deps in the workspace manifests.
+    CRATES_ORDER = ws.publish_order()
+    start = resolve_start(ws, CRATES_ORDER, args.start_from)
+
+    # Print the order, so that an interrupted run can be resumed by name.
+    for i, crate in enumerate(CRATES_ORDER):
+        print(f"{i:>3} {crate}{'  <- start' if i == start else ''}")
+
     # First, rename all
-    for crate in CRATES_ORDER:
-        rename_and_update(crate)
+    ws.rename_for_fork(NEW_VERSION)
+    if args.dry_run:
+        sys.stdout.write(ws.diff())
+        sys.exit(0)
+    ws.commit()
     
     # Then publish with delay, starting from specified index
     for i, crate in enumerate(CRATES_ORDER):
-        if i < args.start_from:
+        if i < start:
             print(f"Skipping {crate} (already published)")
             continue
         if publish(crate):